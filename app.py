@@ -1,38 +1,36 @@
 import streamlit as st
 import pandas as pd
-import json
-import io
-from PIL import Image
-from pydantic import BaseModel, Field
-from typing import List, Optional
+import os
 from google import genai
-from google.genai import types
-import calendar
-from pypdf import PdfReader
-import pdfplumber
+import time
+import uuid
+
+from brl_codec import format_brl
+from classification_store import ClassificationStore, ESCOPO_GEMINI
+from classify_transactions import VOCABULARIO_CLASSIFICACAO, classification_keys
+from classify_with_gemini import classify_keys_batch
+from export_reports import (
+    FORMATOS_EXPORTACAO, ROTA_EXPORTACAO, export_bytes, export_to_file, ledger_cube, register_export,
+    streaming_route_enabled,
+)
+from extract_with_gemini import ReportCache
+from gemini_scheduler import (
+    GeminiScheduler, ScheduledClient, LIMITE_RPM_PADRAO, LIMITE_TPM_PADRAO,
+    PRIORIDADE_INTERATIVA, PRIORIDADE_LOTE,
+)
+from import_statements import FORMATOS_IMPORTACAO, iter_statement_chunks, to_transacao_columns
+from ingest_transactions import TransactionAccumulator, totais_por_tipo
+from pdf_page_cache import extract_statement_pages
+from session_ledgers import LedgerGovernor, fingerprint_ledger
 
 
 # --- FUNÇÃO DE FORMATAÇÃO BRL (NOVO) ---
 def formatar_brl(valor: float) -> str:
     """
     Formata um valor float para a moeda Real Brasileiro (R$ xx.xxx,xx).
-    Esta função usa uma abordagem manual para garantir a portabilidade do separador de milhares (ponto) 
-    e separador decimal (vírgula).
+    Para colunas inteiras, use format_brl (brl_codec) diretamente: a formatação é feita em bloco.
     """
-    # Arredonda o valor e usa formatação US (vírgula para milhar, ponto para decimal)
-    # Ex: 12345.67 -> '12,345.67'
-    valor_us = f"{valor:,.2f}"
-    
-    # 1. Troca o separador de milhares US (vírgula) por um temporário
-    valor_brl = valor_us.replace(",", "TEMP_SEP")
-    
-    # 2. Troca o separador decimal US (ponto) por vírgula BR
-    valor_brl = valor_brl.replace(".", ",")
-    
-    # 3. Troca o separador temporário por ponto BR (milhares)
-    valor_brl = valor_brl.replace("TEMP_SEP", ".")
-    
-    return "R$ " + valor_brl
+    return format_brl([valor])[0]
 # --- FIM FUNÇÃO DE FORMATAÇÃO BRL ---
 
 
@@ -124,208 +122,219 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Inicializa o estado da sessão para armazenar o DataFrame
-if 'df_transacoes_editado' not in st.session_state:
-    st.session_state['df_transacoes_editado'] = pd.DataFrame()
+# Inicializa o estado da sessão (o DataFrame de transações fica no LedgerGovernor do processo)
 if 'relatorio_consolidado' not in st.session_state:
     st.session_state['relatorio_consolidado'] = "Aguardando análise de dados..."
 if 'contexto_adicional' not in st.session_state:
     st.session_state['contexto_adicional'] = ""
+# Payload das transações em cache e relatórios memorizados por (versão do razão, contexto)
+if 'cache_relatorios' not in st.session_state:
+    st.session_state['cache_relatorios'] = ReportCache()
+
+# Scheduler único do processo: um genai.Client compartilhado, limites de RPM/TPM e fila de prioridade
+@st.cache_resource
+def obter_gemini_scheduler(api_key: str, rpm: int, tpm: int) -> GeminiScheduler:
+    return GeminiScheduler(genai.Client(api_key=api_key), rpm=rpm, tpm=tpm)
 
 # Inicializa o cliente Gemini
 try:
     # Tenta carregar a chave de API dos secrets do Streamlit Cloud
     api_key = st.secrets["GEMINI_API_KEY"]
-    client = genai.Client(api_key=api_key)
+    gemini_scheduler = obter_gemini_scheduler(
+        api_key,
+        int(st.secrets.get("GEMINI_RPM", LIMITE_RPM_PADRAO)),
+        int(st.secrets.get("GEMINI_TPM", LIMITE_TPM_PADRAO)),
+    )
 except (KeyError, AttributeError):
     st.error("ERRO: Chave 'GEMINI_API_KEY' não encontrada nos secrets do Streamlit. Por favor, configure-a para rodar a aplicação.")
     st.stop()
 
+# Identificador da sessão para a divisão justa da fila entre usuários
+if 'sessao_id' not in st.session_state:
+    st.session_state['sessao_id'] = uuid.uuid4().hex
 
-# --- 2. DEFINIÇÃO DO SCHEMA PYDANTIC (Estrutura de Saída) ---
+# Extração em massa entra na fila de lote; relatórios pedidos pelo usuário furam a fila
+client = gemini_scheduler.client_for(st.session_state['sessao_id'], PRIORIDADE_LOTE)
+client_interativo = gemini_scheduler.client_for(st.session_state['sessao_id'], PRIORIDADE_INTERATIVA)
 
-class Transacao(BaseModel):
-    """Representa uma única transação no extrato bancário."""
-    data: str = Field(
-        description="A data da transação no formato 'DD/MM/AAAA' ou 'AAAA-MM-DD'."
-    )
-    descricao: str = Field(
-        description="Descrição detalhada da transação, como o nome do estabelecimento ou tipo de serviço."
-    )
-    valor: float = Field(
-        description="O valor numérico da transação. Sempre positivo. Ex: 150.75"
-    )
-    tipo_movimentacao: str = Field(
-        description="Classificação da movimentação: 'DEBITO' ou 'CREDITO'."
-    )
-    categoria_sugerida: str = Field(
-        description="Sugestão de categoria mais relevante para esta transação (Ex: 'Alimentação', 'Transporte', 'Salário', 'Investimento', 'Serviços')."
-    )
-    categoria_dcf: str = Field( 
-        description="Classificação da transação para o Demonstrativo de Fluxo de Caixa (DCF): 'OPERACIONAL', 'INVESTIMENTO' ou 'FINANCIAMENTO'."
-    )
-    entidade: str = Field(
-        description="Classificação binária para identificar a origem/destino da movimentação: 'EMPRESARIAL' (relacionada ao negócio) ou 'PESSOAL' (retiradas dos sócios ou gastos pessoais detectados)."
-    )
 
-class ExtratoBancarioCompleto(BaseModel):
-    """Contém a lista de transações e o relatório de análise."""
-    transacoes: List[Transacao] = Field(
-        description="Uma lista de objetos 'Transacao' extraídos do documento."
-    )
-    saldo_final: float = Field(
-        description="O saldo final da conta no extrato. Use zero se não for encontrado."
-    )
-    relatorio_analise: str = Field(
-        description="Confirmação de extração dos dados deste extrato. Use 'Extração de dados concluída com sucesso.'"
-    )
+# Store de classificações aprendidas, compartilhado por todas as sessões do processo
+@st.cache_resource
+def obter_classification_store() -> ClassificationStore:
+    return ClassificationStore()
+
+classification_store = obter_classification_store()
+
+
+# Razões de todas as sessões: compartilhados por conteúdo e despejados em disco quando a sessão fica ociosa
+@st.cache_resource
+def obter_ledger_governor() -> LedgerGovernor:
+    return LedgerGovernor()
+
+ledger_governor = obter_ledger_governor()
+
+def obter_df_transacoes() -> pd.DataFrame:
+    """Razão da sessão atual (somente leitura: pode ser compartilhado com outras sessões)."""
+    df = ledger_governor.get(st.session_state['sessao_id'])
+    return pd.DataFrame() if df is None else df
+
+def descartar_razao_da_sessao():
+    """Libera o razão da sessão no LedgerGovernor (nova análise ou uploads removidos) e o cache do relatório."""
+    ledger_governor.release(st.session_state['sessao_id'])
+    st.session_state.pop('razao_fingerprint', None)
+    st.session_state['cache_relatorios'].descartar(client_interativo)
+    st.session_state['relatorio_consolidado'] = "Aguardando análise de dados..."
+
+def ao_alterar_uploads():
+    # Todos os arquivos removidos: a análise anterior deixa de ocupar memória
+    if not st.session_state.get('extratos_enviados'):
+        descartar_razao_da_sessao()
+
+# Cubo por versão do razão (fingerprint do LedgerGovernor): reruns e exportação não reagregam as transações
+@st.cache_resource(max_entries=64)
+def obter_cubo_fluxo(fingerprint: str, _df_transacoes: pd.DataFrame):
+    return ledger_cube(_df_transacoes)
+
+
+# --- 2. DEFINIÇÃO DO SCHEMA PYDANTIC (Estrutura de Saída) ---
+# Transacao e ExtratoBancarioCompleto ficam em extract_with_gemini (usados também fora do Streamlit)
 
 
 # --- 3. FUNÇÃO DE CHAMADA DA API PARA EXTRAÇÃO ---
 
-@st.cache_data(show_spinner=False, hash_funcs={genai.Client: lambda _: None})
-def extract_text_and_tables_from_pdf(pdf_bytes: bytes) -> str:
-    """Extrai texto e tenta extrair tabelas de um PDF em bytes usando pdfplumber."""
-    full_text = []
+def falha_extracao(filename: str, e: Exception) -> dict:
+    """Trata o erro da chamada de extração e retorna o resultado vazio padrão."""
+    error_message = str(e)
+    
+    # TRATAMENTO ESPECÍFICO PARA ERRO DE SOBRECARGA DA API (503 UNAVAILABLE)
+    if "503 UNAVAILABLE" in error_message or "model is overloaded" in error_message:
+        st.error(f"⚠️ ERRO DE CAPACIDADE DA API: O modelo Gemini está sobrecarregado (503 UNAVAILABLE) ao processar {filename}.")
+        st.info("Este é um erro temporário do servidor da API. Por favor, tente novamente em alguns minutos. O problema não está no seu código ou no seu PDF.")
+    else:
+        # Erro genérico (API Key errada, PDF ilegível, etc.)
+        print(f"Erro ao chamar a Gemini API para {filename}: {error_message}")
+
+    return {
+        'transacoes': [], 
+        'saldo_final': 0.0, 
+        'relatorio_analise': f"**Falha na Extração:** Ocorreu um erro ao processar o arquivo {filename}. Motivo: {error_message}"
+    }
+
+@st.cache_data(show_spinner=False, hash_funcs={genai.Client: lambda _: None, ScheduledClient: lambda _: None})
+def analisar_extrato(pdf_bytes: bytes, filename: str, client: genai.Client) -> dict:
+    """Chama a Gemini API para extrair dados estruturados e classificar DCF e Entidade.
+
+    O trabalho é feito por página: texto e resultado da IA de páginas já vistas (extratos
+    cumulativos ou reimpressos) vêm do cache de páginas, e só as páginas novas são processadas."""
     try:
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages:
-                # Extrair texto da página
-                page_text = page.extract_text(x_tolerance=2) or ""
-                full_text.append(page_text)
-
-                # Extrair tabelas da página
-                tables = page.extract_tables()
-                for table in tables:
-                    table_str = "\n".join(["\t".join(row) for row in table if row])
-                    if table_str:
-                        full_text.append("\n--- TABELA INÍCIO ---\n" + table_str + "\n--- TABELA FIM ---\n")
-
-        return "\n".join(full_text)
+        return extract_statement_pages(pdf_bytes, filename, client, classification_store)
     except Exception as e:
-        st.error(f"Erro ao extrair texto e tabelas do PDF: {e}")
-        return ""
-
-@st.cache_data(show_spinner=False, hash_funcs={genai.Client: lambda _: None})
-def analisar_extrato(pdf_bytes: bytes, filename: str, client: genai.Client) -> dict:
-    """Chama a Gemini API para extrair dados estruturados e classificar DCF e Entidade."""
-    
-    extracted_text = extract_text_and_tables_from_pdf(pdf_bytes)
-    if not extracted_text:
-        return {
-            'transacoes': [],
-            'saldo_final': 0.0,
-            'relatorio_analise': f"**Falha na Extração:** Não foi possível extrair texto do arquivo {filename}."
-        }
-    prompt_analise = (
-        f"Você é um especialista em extração e classificação de dados financeiros. "        f"Seu trabalho é extrair todas as transações deste extrato bancário fornecido como TEXTO do arquivo '{filename}' e "        "classificar cada transação rigorosamente em uma 'categoria_dcf' ('OPERACIONAL', 'INVESTIMENTO' ou 'FINANCIAMENTO') E "
-        "em uma 'entidade' ('EMPRESARIAL' ou 'PESSOAL'). "
-        "Use o contexto de que a maioria das movimentações devem ser EMPRESARIAIS, mas qualquer retirada para sócios, pagamento de contas pessoais ou compras não relacionadas ao CNPJ deve ser classificada como PESSOAL. "
-        "Não gere relatórios. Preencha apenas a estrutura JSON rigorosamente. "
-        "Use sempre o valor positivo para 'valor' e classifique estritamente como 'DEBITO' ou 'CREDITO'."
-    )
-    
-    config = types.GenerateContentConfig(
-        response_mime_type="application/json",
-        response_schema=ExtratoBancarioCompleto,
-        temperature=0.2 # Baixa temperatura para foco na extração
-    )
+        return falha_extracao(filename, e)
 
+def analisar_extrato_stream(pdf_bytes: bytes, filename: str, client: genai.Client, ao_receber_transacoes) -> dict:
+    """Versão em streaming de analisar_extrato: entrega as transações parciais (páginas do cache primeiro)
+    a 'ao_receber_transacoes' à medida que chegam."""
     try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', # ALTERADO DE gemini-2.5-pro PARA gemini-2.5-flash
-            contents=[extracted_text, prompt_analise],
-            config=config,
-        )
-        
-        response_json = json.loads(response.text)
-        dados_pydantic = ExtratoBancarioCompleto(**response_json)
-        
-        return dados_pydantic.model_dump()
-    
+        return extract_statement_pages(pdf_bytes, filename, client, classification_store, ao_receber_transacoes)
     except Exception as e:
-        error_message = str(e)
-        
-        # TRATAMENTO ESPECÍFICO PARA ERRO DE SOBRECARGA DA API (503 UNAVAILABLE)
-        if "503 UNAVAILABLE" in error_message or "model is overloaded" in error_message:
-            st.error(f"⚠️ ERRO DE CAPACIDADE DA API: O modelo Gemini está sobrecarregado (503 UNAVAILABLE) ao processar {filename}.")
-            st.info("Este é um erro temporário do servidor da API. Por favor, tente novamente em alguns minutos. O problema não está no seu código ou no seu PDF.")
-        else:
-            # Erro genérico (API Key errada, PDF ilegível, etc.)
-            print(f"Erro ao chamar a Gemini API para {filename}: {error_message}")
+        return falha_extracao(filename, e)
 
-        return {
-            'transacoes': [], 
-            'saldo_final': 0.0, 
-            'relatorio_analise': f"**Falha na Extração:** Ocorreu um erro ao processar o arquivo {filename}. Motivo: {error_message}"
-        }
+def importar_extrato_estruturado(arquivo, filename: str, acumulador: TransactionAccumulator) -> str:
+    """Importa um extrato OFX/CSV direto para o acumulador (leitura em blocos) e retorna a mensagem do relatório.
+
+    Os blocos só entram no acumulador quando o arquivo inteiro foi lido: um erro no meio não deixa o
+    arquivo pela metade no razão."""
+    blocos, erros = [], []
+    try:
+        for chunk in iter_statement_chunks(filename, arquivo, erros=erros):
+            blocos.append(to_transacao_columns(chunk, classification_store))
+    except ValueError as e:
+        st.warning(f"Não foi possível importar {filename}: {e}")
+        return f"Falha na importação de {filename}."
+    for colunas in blocos:
+        acumulador.add_columns(colunas)
+    total = sum(len(colunas['data']) for colunas in blocos)
+    if erros:
+        st.warning(f"Linhas descartadas na importação de {filename}: {'; '.join(erros)}")
+        return f"Importação direta de {filename} concluída com avisos: {total} transações; {'; '.join(erros)}"
+    return f"Importação direta de {filename} concluída: {total} transações (sem uso da IA na extração)."
 
 # --- 3.1. FUNÇÃO DE GERAÇÃO DE RELATÓRIO CONSOLIDADO ---
 
 def gerar_relatorio_consolidado(df_transacoes: pd.DataFrame, contexto_adicional: str, client: genai.Client) -> str:
     """Gera o relatório de análise consolidado, agora mais conciso e focado no split Entidade/DCF. 
-        Aplica filtro de colunas e formatação de data para reduzir o payload de JSON."""
-    
-    # CRITICAL FIX: Criar uma cópia do DF e formatar/filtrar colunas para reduzir o tamanho do JSON payload
-    df_temp = df_transacoes.copy()
-    
-    # 1. Formatar a data para uma string simples (YYYY-MM-DD) antes de serializar
-    df_temp['data'] = df_temp['data'].dt.strftime('%Y-%m-%d')
-    
-    # 2. Selecionar apenas as colunas essenciais para a análise do LLM
-    df_analise = df_temp[['data', 'descricao', 'valor', 'tipo_movimentacao', 
-                          'categoria_sugerida', 'categoria_dcf', 'entidade']]
-    
-    # Gerar o JSON a partir do DF filtrado (muito menor)
-    transacoes_json = df_analise.to_json(orient='records', date_format='iso', indent=2)
-    
-    # Adiciona o contexto do usuário ao prompt
-    contexto_prompt = ""
-    if contexto_adicional:
-        contexto_prompt = f"Considere também o seguinte contexto adicional fornecido pelo usuário: {contexto_adicional}\n\n"
-
-    prompt_consolidado = (
-        f"Você é um analista financeiro experiente. Analise o seguinte conjunto de transações bancárias em formato JSON: "
-        f"\n\n```json\n{transacoes_json}\n```\n\n"
-        f"{contexto_prompt}"
-        "Com base nessas transações, forneça um relatório conciso e objetivo, com foco na classificação de 'entidade' (EMPRESARIAL ou PESSOAL) e 'categoria_dcf' (OPERACIONAL, INVESTIMENTO, FINANCIAMENTO). "
-        "Destaque os principais pontos de entrada e saída de recursos, e aponte quaisquer anomalias ou observações relevantes sobre o fluxo de caixa da entidade. "
-        "Não inclua o saldo final, pois ele já é uma métrica separada. O relatório deve ser em português do Brasil e ter no máximo 200 palavras."
-    )
-
+        As transações são enviadas uma vez por versão do razão; atualizações de contexto reaproveitam o cache."""
     try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', # ALTERADO DE gemini-2.5-pro PARA gemini-2.5-flash
-            contents=[prompt_consolidado],
-            config=types.GenerateContentConfig(
-                temperature=0.7 # Temperatura mais alta para criatividade na análise
-            )
-        )
-        return response.text
+        return st.session_state['cache_relatorios'].gerar(df_transacoes, contexto_adicional, client)
     except Exception as e:
         st.error(f"Erro ao gerar relatório consolidado: {e}")
         return f"Falha ao gerar relatório consolidado. Motivo: {e}"
 
 # --- 4. FUNÇÕES DE PROCESSAMENTO E VISUALIZAÇÃO ---
 
-def processar_df_transacoes(df: pd.DataFrame) -> pd.DataFrame:
-    """Processa o DataFrame para garantir tipos corretos e adicionar colunas calculadas."""
-    df['data'] = pd.to_datetime(df['data'], errors='coerce', dayfirst=True)
-    df['valor'] = pd.to_numeric(df['valor'], errors='coerce')
-    
-    # Calcula o fluxo de caixa (valor positivo para crédito, negativo para débito)
-    df['fluxo_caixa'] = df.apply(
-        lambda row: row['valor'] if row['tipo_movimentacao'] == 'CREDITO' else -row['valor'],
-        axis=1
-    )
+CAMPOS_CLASSIFICACAO = ['categoria_sugerida', 'categoria_dcf', 'entidade']
+
+def aplicar_classificacoes_aprendidas(df: pd.DataFrame, store: ClassificationStore) -> pd.DataFrame:
+    """Padroniza a classificação por descrição normalizada, reaproveitando e aprendendo mapeamentos.
+
+    Cada processamento vota, por chave, na classificação mais frequente que o Gemini deu a ela neste
+    razão; o mapeamento aprendido é o mais votado até agora (ver ClassificationStore.registrar_votos).
+    Reprocessar o mesmo razão não vota de novo.
+    """
+    razao = fingerprint_ledger(df)
+    chaves = classification_keys(df['descricao'], df['tipo_movimentacao'] == 'CREDITO')
+    # Descrições que ficam vazias após a normalização mantêm a classificação original
+    validas = chaves.str.len() > 2
+
+    conhecidas = store.get_many(ESCOPO_GEMINI, pd.unique(chaves[validas]))
+
+    # Um voto por chave e processamento, para que uma descrição repetida não pese mais que as outras
+    # (linhas importadas de OFX/CSV chegam sem DCF/Entidade e não votam)
+    linhas = df.loc[validas, CAMPOS_CLASSIFICACAO].assign(chave=chaves).dropna(subset=['categoria_dcf', 'entidade'])
+    # Só valores do vocabulário do classificador votam (a extração sugere categorias livres)
+    for campo, permitidos in VOCABULARIO_CLASSIFICACAO.items():
+        linhas[campo] = linhas[campo].where(linhas[campo].isin(permitidos))
+    votos = linhas.value_counts(sort=True, dropna=False).reset_index().drop_duplicates('chave').set_index('chave')
+    conhecidas.update(store.registrar_votos(
+        ESCOPO_GEMINI, votos[CAMPOS_CLASSIFICACAO].to_dict(orient='index'), origem=razao
+    ))
+
+    for campo in CAMPOS_CLASSIFICACAO:
+        mapeamento = {chave: valor.get(campo) for chave, valor in conhecidas.items()}
+        mapeado = chaves.map(mapeamento)
+        df[campo] = mapeado.where(validas & mapeado.notna(), df[campo])
+    return df
+
+def completar_classificacoes_pendentes(df: pd.DataFrame, client, store: ClassificationStore) -> pd.DataFrame:
+    """Classifica em lote, via Gemini, as linhas ainda sem DCF/Entidade (ex: importadas de OFX/CSV)."""
+    pendentes = df['categoria_dcf'].isna() | df['entidade'].isna()
+    if not pendentes.any():
+        return df
+
+    chaves = classification_keys(df.loc[pendentes, 'descricao'], df.loc[pendentes, 'tipo_movimentacao'] == 'CREDITO')
+    erros = []
+    classificacoes = classify_keys_batch(pd.unique(chaves), client, store, erros=erros)
+    if erros:
+        st.warning(f"{len(erros)} problema(s) na classificação pela Gemini; as transações afetadas ficaram sem DCF/Entidade. "
+                   f"Exemplos: {'; '.join(erros[:3])}")
+    for campo in CAMPOS_CLASSIFICACAO:
+        valores = chaves.map({chave: valor.get(campo) for chave, valor in classificacoes.items()})
+        if campo == 'categoria_sugerida':
+            # A categoria das regras só é substituída quando elas não a resolveram
+            valores = valores.where(df.loc[pendentes, campo].isin(['Outros']) | df.loc[pendentes, campo].isna())
+        resolvidos = valores.notna()
+        df.loc[valores.index[resolvidos], campo] = valores[resolvidos]
     return df
 
 def exibir_kpis(df_transacoes: pd.DataFrame):
     """Exibe os principais KPIs financeiros em cards estilizados."""
-    st.markdown("<h2 style='text-align: center; color: #0A2342;'>Resumo Financeiro</h2>", unsafe_allow_html=True)
-
     total_credito = df_transacoes[df_transacoes['tipo_movimentacao'] == 'CREDITO']['valor'].sum()
     total_debito = df_transacoes[df_transacoes['tipo_movimentacao'] == 'DEBITO']['valor'].sum()
+    exibir_cards_kpi(total_credito, total_debito)
+
+def exibir_cards_kpi(total_credito: float, total_debito: float):
+    """Cards de créditos, débitos e saldo líquido a partir dos totais já calculados."""
+    st.markdown("<h2 style='text-align: center; color: #0A2342;'>Resumo Financeiro</h2>", unsafe_allow_html=True)
     saldo_liquido = total_credito - total_debito
 
     col1, col2, col3 = st.columns(3)
@@ -350,21 +359,28 @@ def exibir_kpis(df_transacoes: pd.DataFrame):
                         f"<p style='font-size: 2em; font-weight: bold; color: {color_saldo};'>{formatar_brl(saldo_liquido)}</p>"
                         f"</div>", unsafe_allow_html=True)
 
-def exibir_analise_dcf_entidade(df_transacoes: pd.DataFrame):
-    """Exibe a análise de fluxo de caixa por DCF e Entidade."""
+def exibir_extracao_parcial(area, totais: dict, df_recentes: pd.DataFrame, total_transacoes: int):
+    """Renderiza KPIs (de totais acumulados) e as transações mais recentes recebidas até o momento."""
+    with area.container():
+        exibir_cards_kpi(totais['CREDITO'], totais['DEBITO'])
+        st.caption(f"{total_transacoes} transação(ões) recebida(s); exibindo as {len(df_recentes)} mais recentes.")
+        st.dataframe(df_recentes, use_container_width=True, hide_index=True)
+
+def exibir_analise_dcf_entidade(cube):
+    """Exibe a análise de fluxo de caixa por DCF e Entidade (lida do cubo, sem reagrupar as transações)."""
     st.markdown("<h2 style='text-align: center; color: #0A2342;'>Análise de Fluxo de Caixa por DCF e Entidade</h2>", unsafe_allow_html=True)
 
     # Agrupamento por Categoria DCF
-    dcf_summary = df_transacoes.groupby('categoria_dcf')['fluxo_caixa'].sum().reset_index()
+    dcf_summary = cube.totais(('DCF',))['Valor'].rename('fluxo_caixa').reset_index().rename(columns={'DCF': 'categoria_dcf'})
     dcf_summary['fluxo_caixa_abs'] = dcf_summary['fluxo_caixa'].abs() # Para ordenação
     dcf_summary = dcf_summary.sort_values(by='fluxo_caixa_abs', ascending=False)
-    dcf_summary['fluxo_caixa_formatado'] = dcf_summary['fluxo_caixa'].apply(formatar_brl)
+    dcf_summary['fluxo_caixa_formatado'] = format_brl(dcf_summary['fluxo_caixa'])
 
     # Agrupamento por Entidade
-    entidade_summary = df_transacoes.groupby('entidade')['fluxo_caixa'].sum().reset_index()
+    entidade_summary = cube.totais(('Entidade',))['Valor'].rename('fluxo_caixa').reset_index().rename(columns={'Entidade': 'entidade'})
     entidade_summary['fluxo_caixa_abs'] = entidade_summary['fluxo_caixa'].abs() # Para ordenação
     entidade_summary = entidade_summary.sort_values(by='fluxo_caixa_abs', ascending=False)
-    entidade_summary['fluxo_caixa_formatado'] = entidade_summary['fluxo_caixa'].apply(formatar_brl)
+    entidade_summary['fluxo_caixa_formatado'] = format_brl(entidade_summary['fluxo_caixa'])
 
     col_dcf, col_entidade = st.columns(2)
 
@@ -396,17 +412,20 @@ def exibir_transacoes_detalhadas(df_transacoes: pd.DataFrame):
         tipos_mov_unicos = ['Todas'] + list(df_transacoes['tipo_movimentacao'].unique())
         filtro_mov = st.selectbox("Filtrar por Movimentação", tipos_mov_unicos)
 
-    df_filtrado = df_transacoes.copy()
+    # Uma única máscara: sem filtro, a tabela exibida é o próprio razão (sem cópias intermediárias)
+    filtro = pd.Series(True, index=df_transacoes.index)
     if filtro_dcf != 'Todas':
-        df_filtrado = df_filtrado[df_filtrado['categoria_dcf'] == filtro_dcf]
+        filtro &= df_transacoes['categoria_dcf'] == filtro_dcf
     if filtro_entidade != 'Todas':
-        df_filtrado = df_filtrado[df_filtrado['entidade'] == filtro_entidade]
+        filtro &= df_transacoes['entidade'] == filtro_entidade
     if filtro_mov != 'Todas':
-        df_filtrado = df_filtrado[df_filtrado['tipo_movimentacao'] == filtro_mov]
+        filtro &= df_transacoes['tipo_movimentacao'] == filtro_mov
+    df_filtrado = df_transacoes if filtro.all() else df_transacoes[filtro]
 
-    # Exibir o DataFrame editável
+    # Exibir o DataFrame editável. Sem Styler: ele montaria o CSS de cada célula do razão a cada rerun;
+    # crédito/débito aparecem no Tipo e no sinal do Fluxo de Caixa
     st.dataframe(
-        df_filtrado.style.apply(lambda x: ['background-color: #e6ffe6' if x['tipo_movimentacao'] == 'CREDITO' else 'background-color: #ffe6e6' for i in x], axis=1),
+        df_filtrado,
         use_container_width=True,
         hide_index=True,
         column_config={
@@ -426,49 +445,124 @@ st.image(LOGO_FILENAME, width=200)
 st.markdown("<h1 class='main-header'>Análise de Extratos Bancários com IA</h1>", unsafe_allow_html=True)
 st.markdown("### Faça o upload de seus extratos em PDF para uma análise financeira inteligente.")
 
-uploaded_files = st.file_uploader("Arraste e solte seus extratos bancários em PDF aqui ou clique para selecionar", type=["pdf"], accept_multiple_files=True)
+uploaded_files = st.file_uploader(
+    "Arraste e solte seus extratos bancários em PDF, OFX ou CSV aqui ou clique para selecionar",
+    type=["pdf", "ofx", "csv"], accept_multiple_files=True,
+    key='extratos_enviados', on_change=ao_alterar_uploads,
+)
+
+# Intervalo mínimo (segundos) entre atualizações da prévia no modo streaming
+INTERVALO_RENDERIZACAO_PARCIAL = 0.5
+# Linhas exibidas na prévia: o custo de cada atualização não cresce com o total já extraído
+MAX_LINHAS_PREVIA = 200
 
 if uploaded_files:
+    modo_streaming = st.toggle("Exibir transações durante a extração (streaming)", value=True)
     if st.button("Processar Extratos"): # Botão para iniciar o processamento
-        df_transacoes_acumulado = pd.DataFrame()
+        # A análise anterior é substituída: o razão dela não fica contado no orçamento durante a extração
+        descartar_razao_da_sessao()
+        # Buffers por coluna: cada arquivo é anexado sem recopiar o que já foi acumulado
+        acumulador = TransactionAccumulator()
         relatorios_analise = []
 
+        # Prévia progressiva: arquivos já concluídos + transações do arquivo em andamento (modo streaming).
+        # KPIs vêm de somas mantidas a cada lote e a tabela mostra só as últimas linhas, sem remontar o razão
+        area_parcial = st.empty()
+        transacoes_parciais = []
+        totais_parciais = {'CREDITO': 0.0, 'DEBITO': 0.0}
+        ultima_renderizacao = {'instante': 0.0}
+
+        def limpar_parciais():
+            transacoes_parciais.clear()
+            totais_parciais.update(CREDITO=0.0, DEBITO=0.0)
+
+        def atualizar_previa():
+            totais = acumulador.totals()
+            totais = {tipo: soma + totais_parciais[tipo] for tipo, soma in totais.items()}
+            df_recentes = acumulador.tail(MAX_LINHAS_PREVIA)
+            if transacoes_parciais:
+                df_recentes = pd.concat(
+                    [df_recentes, pd.DataFrame(transacoes_parciais[-MAX_LINHAS_PREVIA:])], ignore_index=True
+                ).tail(MAX_LINHAS_PREVIA)
+            exibir_extracao_parcial(area_parcial, totais, df_recentes, len(acumulador) + len(transacoes_parciais))
+
+        def talvez_atualizar_previa():
+            # Limita a frequência da prévia para que o custo de renderização não cresça com o número de arquivos
+            agora = time.monotonic()
+            if agora - ultima_renderizacao['instante'] >= INTERVALO_RENDERIZACAO_PARCIAL:
+                ultima_renderizacao['instante'] = agora
+                atualizar_previa()
+
+        def ao_receber_transacoes(novas: list):
+            transacoes_parciais.extend(novas)
+            for tipo, soma in totais_por_tipo([t.get('valor') for t in novas], [t.get('tipo_movimentacao') for t in novas]).items():
+                totais_parciais[tipo] += soma
+            talvez_atualizar_previa()
+
         for uploaded_file in uploaded_files:
-            pdf_bytes = uploaded_file.getvalue()
             filename = uploaded_file.name
 
+            # OFX/CSV exportados pelo banco: importação direta, sem pdfplumber nem Gemini
+            if os.path.splitext(filename)[1].lower() in FORMATOS_IMPORTACAO:
+                with st.spinner(f"Importando {filename}..."):
+                    relatorios_analise.append(importar_extrato_estruturado(uploaded_file, filename, acumulador))
+                    talvez_atualizar_previa()
+                continue
+
+            pdf_bytes = uploaded_file.getvalue()
+
             with st.spinner(f"Analisando {filename}..."):
-                dados_extraidos = analisar_extrato(pdf_bytes, filename, client)
+                limpar_parciais()
+                if modo_streaming:
+                    dados_extraidos = analisar_extrato_stream(pdf_bytes, filename, client, ao_receber_transacoes)
+                else:
+                    dados_extraidos = analisar_extrato(pdf_bytes, filename, client)
+                limpar_parciais()
                 
-                if dados_extraidos and dados_extraidos['transacoes']:
-                    df_temp = pd.DataFrame(dados_extraidos['transacoes'])
-                    df_temp = processar_df_transacoes(df_temp)
-                    df_transacoes_acumulado = pd.concat([df_transacoes_acumulado, df_temp], ignore_index=True)
+                erros_validacao = dados_extraidos.get('erros_validacao') or []
+                if erros_validacao:
+                    st.warning(
+                        f"{len(erros_validacao)} problema(s) de validação em {filename}; as transações afetadas foram descartadas. "
+                        f"Exemplos: {'; '.join(erros_validacao[:3])}"
+                    )
+
+                if dados_extraidos and len(dados_extraidos['transacoes']):
+                    acumulador.add_columns(dados_extraidos['transacoes'])
                     relatorios_analise.append(dados_extraidos['relatorio_analise'])
+                    talvez_atualizar_previa()
                 else:
                     st.warning(f"Nenhuma transação extraída ou erro no arquivo {filename}. Mensagem: {dados_extraidos.get('relatorio_analise', 'Erro desconhecido')}")
                     relatorios_analise.append(f"Falha na extração de {filename}.")
 
+        area_parcial.empty()
+
+        # Normalização e montagem do DataFrame final em uma única passada
+        df_transacoes_acumulado = acumulador.to_frame()
+
         if not df_transacoes_acumulado.empty:
-            st.session_state['df_transacoes_editado'] = df_transacoes_acumulado
+            df_transacoes_acumulado = aplicar_classificacoes_aprendidas(df_transacoes_acumulado, classification_store)
+            df_transacoes_acumulado = completar_classificacoes_pendentes(df_transacoes_acumulado, client, classification_store)
+            st.session_state['razao_fingerprint'] = ledger_governor.publish(st.session_state['sessao_id'], df_transacoes_acumulado)
             st.session_state['relatorios_analise_individuais'] = relatorios_analise
-            st.session_state['relatorio_consolidado'] = gerar_relatorio_consolidado(df_transacoes_acumulado, st.session_state['contexto_adicional'], client)
+            st.session_state['relatorio_consolidado'] = gerar_relatorio_consolidado(df_transacoes_acumulado, st.session_state['contexto_adicional'], client_interativo)
             st.success("Processamento concluído com sucesso!")
         else:
             st.error("Nenhuma transação pôde ser processada de todos os arquivos.")
 
-if not st.session_state['df_transacoes_editado'].empty:
+df_transacoes_editado = obter_df_transacoes()
+if not df_transacoes_editado.empty:
+    cubo_fluxo = obter_cubo_fluxo(st.session_state['razao_fingerprint'], df_transacoes_editado)
     st.markdown("<h2 style='text-align: center; color: #0A2342;'>Resultados da Análise</h2>", unsafe_allow_html=True)
 
     tab1, tab2, tab3 = st.tabs(["Resumo e KPIs", "Transações Detalhadas", "Relatório IA"])
 
     with tab1:
         st.markdown("<h3 style='color: #0A2342;'>Visão Geral</h3>", unsafe_allow_html=True)
-        exibir_kpis(st.session_state['df_transacoes_editado'])
-        exibir_analise_dcf_entidade(st.session_state['df_transacoes_editado'])
+        exibir_kpis(df_transacoes_editado)
+        exibir_analise_dcf_entidade(cubo_fluxo)
 
     with tab2:
-        exibir_transacoes_detalhadas(st.session_state['df_transacoes_editado'])
+        exibir_transacoes_detalhadas(df_transacoes_editado)
 
     with tab3:
         st.markdown("<h3 style='color: #0A2342;'>Relatório de Análise da IA</h3>", unsafe_allow_html=True)
@@ -477,6 +571,29 @@ if not st.session_state['df_transacoes_editado'].empty:
         for rel in st.session_state['relatorios_analise_individuais']:
             st.info(rel)
 
+    st.markdown("--- \n### Exportar Transações e Relatórios")
+    col_formato, col_download = st.columns(2)
+    with col_formato:
+        formato_exportacao = st.selectbox("Formato de exportação", list(FORMATOS_EXPORTACAO), format_func=str.upper)
+    with col_download:
+        # O arquivo só é gerado (em blocos, em disco) quando o usuário pede
+        nome_exportacao = f"transacoes_hedgewise.{formato_exportacao}"
+        if streaming_route_enabled():
+            # Servido por serve.py: o arquivo sai do disco em blocos pela rota de download
+            if st.button("Gerar Arquivo"):
+                caminho = export_to_file(df_transacoes_editado, formato_exportacao, cube=cubo_fluxo)
+                token = register_export(caminho, nome_exportacao, FORMATOS_EXPORTACAO[formato_exportacao])
+                st.link_button("Baixar Arquivo", f"{ROTA_EXPORTACAO}/{token}")
+        else:
+            # Com 'streamlit run app.py' o Streamlit mantém o arquivo gerado em memória até o download
+            st.download_button(
+                "Baixar Arquivo",
+                data=lambda df=df_transacoes_editado, formato=formato_exportacao: export_bytes(df, formato, cube=cubo_fluxo),
+                file_name=nome_exportacao,
+                mime=FORMATOS_EXPORTACAO[formato_exportacao],
+                on_click='ignore',
+            )
+
     st.markdown("--- \n### Contexto Adicional para Análise da IA")
     st.session_state['contexto_adicional'] = st.text_area(
         "Adicione informações relevantes para refinar a análise da IA (ex: 'Esta conta é para despesas da empresa X', 'Ignorar transações de investimento').",
@@ -484,11 +601,11 @@ if not st.session_state['df_transacoes_editado'].empty:
         height=100
     )
     if st.button("Atualizar Relatório da IA com Contexto Adicional"):
-        if not st.session_state['df_transacoes_editado'].empty:
+        if not df_transacoes_editado.empty:
             st.session_state['relatorio_consolidado'] = gerar_relatorio_consolidado(
-                st.session_state['df_transacoes_editado'], 
+                df_transacoes_editado, 
                 st.session_state['contexto_adicional'], 
-                client
+                client_interativo
             )
             st.success("Relatório da IA atualizado com sucesso!")
         else:
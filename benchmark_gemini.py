@@ -0,0 +1,231 @@
+"""Benchmark ponta a ponta do caminho Gemini (extração + relatório consolidado) sem rede.
+
+As chamadas passam pelo mesmo GeminiScheduler do app, com um ReplayClient no lugar do genai.Client:
+respostas de um cassete gravado (--cassete) ou simuladas a partir de extratos sintéticos. A extração
+segue o caminho do app: uma requisição por página, com o cabeçalho do extrato como contexto e, com
+--cache-paginas, o cache de páginas já extraídas.
+
+Exemplos:
+    python benchmark_gemini.py --arquivos 40 --sessoes 4 --latencia 2 --taxa-503 0.05
+    python benchmark_gemini.py --pdfs extratos/ --gravar extratos.jsonl   # usa GEMINI_API_KEY
+    python benchmark_gemini.py --pdfs extratos/ --cassete extratos.jsonl --workers 8
+"""
+import argparse
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from classification_store import ClassificationStore
+from extract_with_gemini import ExtratoBancarioCompleto, ReportCache
+from gemini_cassettes import RecordingClient, ReplayClient
+from gemini_scheduler import (
+    ESPERA_BASE_RETENTATIVA, LIMITE_RPM_PADRAO, LIMITE_TPM_PADRAO, WORKERS_PADRAO,
+    PRIORIDADE_INTERATIVA, PRIORIDADE_LOTE, GeminiScheduler,
+)
+from ingest_transactions import TransactionAccumulator
+from pdf_page_cache import extract_pages, fingerprint_pages, page_texts
+
+PERCENTIS = (50, 90, 99)
+
+_DESCRICOES_SINTETICAS = (
+    'PIX RECEBIDO CLIENTE', 'TED RECEBIDA', 'PAGAMENTO FORNECEDOR', 'TARIFA PACOTE SERVICOS',
+    'PAGTO BOLETO ENERGIA', 'SAQUE CAIXA ELETRONICO', 'APLICACAO CDB', 'PIX ENVIADO SOCIO',
+)
+_LINHA_SINTETICA = re.compile(r'^(\d{2}/\d{2}/\d{4})\t(.+?)\t([\d.]+,\d{2}) ([CD])$', re.MULTILINE)
+
+
+def extrato_sintetico(indice, transacoes, semente=0, por_pagina=30):
+    """Páginas de texto, no formato produzido por texto_pagina, de um extrato fictício."""
+    aleatorio = random.Random(semente * 100_003 + indice)
+    linhas = []
+    for _ in range(transacoes):
+        valor = f"{aleatorio.uniform(5, 20_000):,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+        linhas.append(
+            f"{aleatorio.randint(1, 28):02d}/{aleatorio.randint(1, 12):02d}/2024\t"
+            f"{aleatorio.choice(_DESCRICOES_SINTETICAS)} {aleatorio.randint(100, 999)}\t{valor} {aleatorio.choice('CD')}"
+        )
+    cabecalho = [
+        f"EXTRATO SINTETICO {indice:05d}", f"Agência 0001 Conta {10_000 + indice}-0",
+        "Período: 01/01/2024 a 31/12/2024", "Data\tHistórico\tValor",
+    ]
+    paginas = [linhas[i:i + por_pagina] for i in range(0, len(linhas), por_pagina)] or [[]]
+    return ["\n".join(cabecalho + paginas[0])] + ["\n".join(pagina) for pagina in paginas[1:]]
+
+
+def simular_resposta(model, contents, config):
+    """Resposta plausível para extratos sintéticos (extração) ou um texto fixo (relatório)."""
+    if getattr(config, 'response_schema', None) is not ExtratoBancarioCompleto:
+        return "Relatório simulado: fluxo de caixa predominantemente EMPRESARIAL e OPERACIONAL."
+    transacoes = [
+        {
+            'data': data, 'descricao': descricao,
+            'valor': float(valor.replace('.', '').replace(',', '.')),
+            'tipo_movimentacao': 'CREDITO' if tipo == 'C' else 'DEBITO',
+            'categoria_sugerida': 'Outros', 'categoria_dcf': 'OPERACIONAL',
+            'entidade': 'PESSOAL' if 'SOCIO' in descricao else 'EMPRESARIAL',
+        }
+        # O cabeçalho enviado como contexto não tem linhas de transação
+        for data, descricao, valor, tipo in _LINHA_SINTETICA.findall("\n".join(c for c in contents if isinstance(c, str)))
+    ]
+    return ExtratoBancarioCompleto(
+        transacoes=transacoes, saldo_final=0.0, relatorio_analise='Extração de dados concluída com sucesso.'
+    ).model_dump_json()
+
+
+def carregar_textos(args):
+    """Lista de (nome do arquivo, páginas de texto, fingerprints das páginas) e o tempo gasto na
+    extração de texto dos PDFs."""
+    if not args.pdfs:
+        return [
+            (f"sintetico_{i:05d}.pdf", extrato_sintetico(i, args.transacoes, args.semente, args.transacoes_por_pagina), None)
+            for i in range(args.arquivos)
+        ], 0.0
+    inicio = time.perf_counter()
+    textos = []
+    for nome in sorted(os.listdir(args.pdfs)):
+        if nome.lower().endswith('.pdf'):
+            with open(os.path.join(args.pdfs, nome), 'rb') as arquivo:
+                pdf_bytes = arquivo.read()
+            fingerprints = fingerprint_pages(pdf_bytes)
+            textos.append((nome, page_texts(pdf_bytes, fingerprints), fingerprints))
+    return textos, time.perf_counter() - inicio
+
+
+def criar_cliente(args):
+    if args.gravar:
+        from google import genai
+        return RecordingClient(genai.Client(api_key=os.environ['GEMINI_API_KEY']), args.gravar)
+    return ReplayClient(
+        args.cassete, latencia=args.latencia, jitter=args.jitter, taxa_503=args.taxa_503,
+        escala_tempo=args.escala_tempo, semente=args.semente,
+        tokens_entrada=args.tokens_entrada, tokens_saida=args.tokens_saida,
+        gerar_resposta=simular_resposta if (args.simular_faltantes or not args.cassete) else None,
+    )
+
+
+def percentis(valores):
+    if not valores:
+        return "sem amostras"
+    return ", ".join(f"p{p}={v:.2f}s" for p, v in zip(PERCENTIS, np.percentile(valores, PERCENTIS)))
+
+
+def executar(args):
+    textos, tempo_pdf = carregar_textos(args)
+    cliente = criar_cliente(args)
+    scheduler = GeminiScheduler(cliente, rpm=args.rpm, tpm=args.tpm, workers=args.workers, espera_base=args.espera_base)
+    store = ClassificationStore(args.cache_paginas) if args.cache_paginas else None
+
+    latencias_extracao, latencias_relatorio, falhas = [], [], []
+    lock = threading.Lock()
+
+    def sessao(indice):
+        # Cada sessão processa seus arquivos em sequência, como o app; as sessões concorrem entre si
+        nome_sessao = f"sessao-{indice}"
+        client = scheduler.client_for(nome_sessao, PRIORIDADE_LOTE)
+        acumulador = TransactionAccumulator()
+        for filename, paginas, fingerprints in textos[indice::args.sessoes]:
+            inicio = time.perf_counter()
+            try:
+                dados = extract_pages(
+                    paginas, filename, client, store, (lambda parciais: None) if args.stream else None,
+                    fingerprints=fingerprints,
+                )
+            except Exception as e:
+                with lock:
+                    falhas.append((filename, e))
+                continue
+            acumulador.add_columns(dados['transacoes'])
+            with lock:
+                latencias_extracao.append(time.perf_counter() - inicio)
+
+        df = acumulador.to_frame()
+        if df.empty:
+            return
+        # Relatório inicial e atualizações com contexto adicional, como o botão do app
+        cache = ReportCache()
+        client_interativo = scheduler.client_for(nome_sessao, PRIORIDADE_INTERATIVA)
+        for contexto in [""] + [f"Contexto adicional {i + 1}." for i in range(args.atualizacoes)]:
+            inicio = time.perf_counter()
+            try:
+                cache.gerar(df, contexto, client_interativo)
+            except Exception as e:
+                with lock:
+                    falhas.append((f"relatório {nome_sessao}", e))
+                return
+            with lock:
+                latencias_relatorio.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessoes) as executor:
+        list(executor.map(sessao, range(args.sessoes)))
+    duracao = time.perf_counter() - inicio
+
+    print(f"Arquivos: {len(textos)} ({sum(len(paginas) for _, paginas, _ in textos)} páginas) em {args.sessoes} sessão(ões), {args.workers} worker(s), "
+          f"RPM={args.rpm}, TPM={args.tpm}, {'streaming' if args.stream else 'sem streaming'}")
+    if args.pdfs:
+        print(f"Extração de texto dos PDFs: {tempo_pdf:.2f}s (fora do tempo total)")
+    print(f"Tempo total: {duracao:.2f}s | arquivos/min: {len(latencias_extracao) / duracao * 60:.1f}")
+    print(f"Latência por arquivo: {percentis(latencias_extracao)}")
+    print(f"Latência do relatório: {percentis(latencias_relatorio)}")
+    print(f"Scheduler: {scheduler.estatisticas}")
+    if isinstance(cliente, ReplayClient):
+        print(f"Cliente: {cliente.estatisticas}")
+    for nome, erro in falhas[:5]:
+        print(f"Falha em {nome}: {erro}")
+    if len(falhas) > 5:
+        print(f"... e mais {len(falhas) - 5} falha(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    entrada = parser.add_argument_group('entrada')
+    entrada.add_argument('--pdfs', help="Diretório com extratos em PDF (sem ele, usa extratos sintéticos).")
+    entrada.add_argument('--arquivos', type=int, default=20, help="Quantidade de extratos sintéticos.")
+    entrada.add_argument('--transacoes', type=int, default=60, help="Transações por extrato sintético.")
+    entrada.add_argument('--transacoes-por-pagina', type=int, default=30, help="Transações por página sintética.")
+    entrada.add_argument('--cache-paginas',
+                         help="SQLite do cache de páginas (sem ele, toda página vai para a LLM); repita para medir o reaproveitamento.")
+
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument('--cassete', help="Reproduz as respostas deste cassete (JSONL).")
+    modo.add_argument('--gravar', help="Chama a API real (GEMINI_API_KEY) e grava as respostas neste cassete.")
+    parser.add_argument('--simular-faltantes', action='store_true', help="Simula requisições ausentes do cassete.")
+
+    simulacao = parser.add_argument_group('simulação')
+    simulacao.add_argument('--latencia', type=float, default=None,
+                           help="Latência por chamada em segundos (padrão: a gravada, ou 1.5 sem cassete).")
+    simulacao.add_argument('--jitter', type=float, default=0.3)
+    simulacao.add_argument('--taxa-503', type=float, default=0.0)
+    simulacao.add_argument('--escala-tempo', type=float, default=1.0, help="Multiplica as esperas simuladas.")
+    simulacao.add_argument('--semente', type=int, default=0)
+    simulacao.add_argument('--tokens-entrada', type=int, default=None,
+                           help="Tokens de entrada informados por resposta (padrão: o gravado, ou estimado).")
+    simulacao.add_argument('--tokens-saida', type=int, default=None,
+                           help="Tokens de saída informados por resposta (padrão: o gravado, ou estimado).")
+
+    agendamento = parser.add_argument_group('scheduler')
+    agendamento.add_argument('--sessoes', type=int, default=4, help="Sessões (usuários) simultâneas.")
+    agendamento.add_argument('--workers', type=int, default=WORKERS_PADRAO)
+    agendamento.add_argument('--rpm', type=int, default=LIMITE_RPM_PADRAO)
+    agendamento.add_argument('--tpm', type=int, default=LIMITE_TPM_PADRAO)
+    agendamento.add_argument('--espera-base', type=float, default=None,
+                             help=f"Espera base das retentativas (padrão: {ESPERA_BASE_RETENTATIVA}s x escala de tempo).")
+    parser.add_argument('--stream', action='store_true', help="Usa generate_content_stream na extração.")
+    parser.add_argument('--atualizacoes', type=int, default=2,
+                        help="Atualizações do relatório com contexto adicional por sessão.")
+
+    args = parser.parse_args()
+    if args.latencia is None and not args.cassete:
+        args.latencia = 1.5
+    if args.espera_base is None:
+        args.espera_base = ESPERA_BASE_RETENTATIVA * args.escala_tempo
+    executar(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Valor no formato brasileiro, já sem 'R$', espaços e sinal: '1.234,56', '1234,5', '1234'
+_PADRAO_BRL = r'^(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d{1,2})?$'
+# Ponto como separador decimal (OFX e alguns CSVs): '1500.25'
+_PADRAO_PONTO_DECIMAL = r'^\d+\.\d+$'
+
+# Quantos exemplos de valores inválidos aparecem na mensagem de erro
+MAX_EXEMPLOS_ERRO = 5
+
+# Divide um float em duas metades de 26 bits (Veltkamp) para obter o produto exato valor * 100
+_FATOR_DIVISAO = 2.0 ** 27 + 1
+
+
+def _como_serie(valores):
+    return valores if isinstance(valores, pd.Series) else pd.Series(valores)
+
+
+def _decodificar(serie, ponto_decimal):
+    """Converte a Series em um array Arrow de float (nulo onde o valor é inválido)."""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        # Números já convertidos são usados como estão (o texto '1.5' seria ambíguo com o milhar)
+        return pa.array(serie.to_numpy(dtype=float, na_value=np.nan), from_pandas=True)
+    try:
+        texto = pa.array(serie, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        numerico = serie.map(lambda v: isinstance(v, numbers.Number) and not isinstance(v, bool)).to_numpy(dtype=bool)
+        if numerico.any():
+            # Texto misturado com números: cada parte é convertida do seu jeito
+            numeros = pd.to_numeric(serie.where(numerico), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+            return pc.if_else(pa.array(numerico), pa.array(numeros, from_pandas=True), _decodificar(serie.where(~numerico), ponto_decimal))
+        # Outros objetos passam pela representação em string
+        texto = pa.array(serie.astype(object).where(serie.isna(), serie.astype(str)), type=pa.string(), from_pandas=True)
+    texto = pc.utf8_trim_whitespace(pc.replace_substring(texto, 'R$', ''))
+    # Espaços internos ('R$ -1 234,00', espaço não separável do Excel); substituições simples são mais rápidas que regex
+    for espaco in (' ', '\u00a0'):
+        texto = pc.replace_substring(texto, espaco, '')
+
+    # Natureza no fim, como nos extratos: '123,45 D' (débito) ou '2.000,00 C' (crédito)
+    texto = pc.utf8_upper(texto)
+    debito = pc.ends_with(texto, 'D')
+    texto = pc.utf8_rtrim(texto, 'CD')
+
+    # Sinal: '-1,00', '1,00-' ou '(1,00)'
+    negativo = pc.or_(
+        pc.or_(pc.starts_with(texto, '-'), pc.ends_with(texto, '-')),
+        pc.and_(pc.starts_with(texto, '('), pc.ends_with(texto, ')')),
+    )
+    negativo = pc.or_(negativo, debito)
+    texto = pc.utf8_trim(texto, '-()')
+
+    brl = pc.match_substring_regex(texto, _PADRAO_BRL)
+    normalizado = pc.replace_substring(pc.replace_substring(texto, '.', ''), ',', '.')
+    candidatos = pc.if_else(brl, normalizado, pa.scalar(None, pa.string()))
+    if ponto_decimal:
+        ponto = pc.and_(pc.invert(brl), pc.match_substring_regex(texto, _PADRAO_PONTO_DECIMAL))
+        candidatos = pc.if_else(ponto, texto, candidatos)
+
+    numeros = pc.cast(candidatos, pa.float64())
+    return pc.if_else(negativo, pc.negate(numeros), numeros)
+
+
+def find_malformed_brl(valores, ponto_decimal=False):
+    """Retorna os valores (com o índice original) que não puderam ser interpretados."""
+    serie = _como_serie(valores)
+    numeros = _decodificar(serie, ponto_decimal)
+    invalidos = pc.is_null(numeros).to_numpy(zero_copy_only=False) & serie.notna().to_numpy()
+    return serie[invalidos]
+
+
+def parse_brl(valores, centavos=False, errors='raise', ponto_decimal=False):
+    """Converte valores em formato brasileiro ('R$ 1.234,56', '-50,00', '(10,00)', '123,45 D') em bloco.
+
+    Retorna float, ou centavos inteiros exatos com centavos=True. Valores inválidos geram
+    ValueError com exemplos (errors='raise') ou viram NaN/<NA> (errors='coerce').
+    Com ponto_decimal=True, valores sem vírgula como '1500.25' usam o ponto como decimal.
+    """
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f"errors deve ser 'raise' ou 'coerce', não '{errors}'.")
+    serie = _como_serie(valores)
+    numeros = _decodificar(serie, ponto_decimal)
+
+    if errors == 'raise':
+        invalidos = pc.is_null(numeros).to_numpy(zero_copy_only=False) & serie.notna().to_numpy()
+        if invalidos.any():
+            exemplos = serie[invalidos].head(MAX_EXEMPLOS_ERRO).to_dict()
+            raise ValueError(f"{int(invalidos.sum())} valor(es) em BRL inválido(s). Exemplos (índice: valor): {exemplos}")
+
+    if centavos:
+        # Entradas com até 2 casas decimais: o arredondamento de valor * 100 é exato
+        inteiros = pc.cast(pc.round(pc.multiply(numeros, 100.0)), pa.int64())
+        resultado = inteiros.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        resultado.index = serie.index
+        return resultado
+    return pd.Series(numeros.to_numpy(zero_copy_only=False), index=serie.index, dtype=float)
+
+
+def _centavos_arredondados(numeros):
+    """Centavos de cada float arredondados como f"{valor:.2f}": pelo valor binário exato, com empate
+    para o par. np.round(valor * 100) erra quando o produto arredonda (2.675 -> 268, 0.005 -> 0)."""
+    produto = numeros * 100.0
+    # Erro exato do produto (Dekker): valor * 100 == produto + erro, pois 100 cabe em 26 bits
+    partes = _FATOR_DIVISAO * numeros
+    alto = partes - (partes - numeros)
+    baixo = numeros - alto
+    erro = (alto * 100.0 - produto) + baixo * 100.0
+
+    arredondado = np.round(produto)  # Empate exato vai para o par, como no format
+    fracao = produto - arredondado
+    # Só na metade exata o erro decide o lado; fora dela ele é menor que a distância até a metade
+    ajuste = ((fracao == 0.5) & (erro > 0)).astype(np.int64) - ((fracao == -0.5) & (erro < 0))
+    # A partir de 2**52 o produto já é inteiro e o erro pode passar de meio centavo
+    ajuste = np.where(np.abs(produto) >= 2.0 ** 52, np.round(erro).astype(np.int64), ajuste)
+    return arredondado.astype(np.int64) + ajuste
+
+
+def format_brl(valores, centavos=False):
+    """Formata valores (float ou centavos inteiros) como 'R$ 1.234,56' em bloco; NaN permanece NaN.
+
+    Floats são arredondados como f"{valor:,.2f}" (mesmo resultado do antigo formatar_brl do app),
+    exceto que valores que arredondam para zero saem 'R$ 0,00', sem o '-0,00'.
+    """
+    serie = _como_serie(valores)
+    numeros = pd.to_numeric(serie).to_numpy(dtype=float, na_value=np.nan)
+    validos = ~np.isnan(numeros)
+
+    inteiros = np.where(validos, numeros, 0)
+    inteiros = np.abs(np.round(inteiros).astype(np.int64) if centavos else _centavos_arredondados(inteiros))
+    reais = inteiros // 100
+
+    # Separador de milhares: os grupos de 3 dígitos são montados do mais alto para o mais baixo
+    grupos = (len(str(int(reais.max()))) + 2) // 3 if len(reais) else 1
+    texto = None
+    for k in range(grupos - 1, -1, -1):
+        grupo = pc.cast(pa.array((reais // 1000 ** k) % 1000), pa.string())
+        if texto is None:
+            texto, iniciado = grupo, pa.array(reais >= 1000 ** k)
+            continue
+        texto = pc.if_else(iniciado, pc.binary_join_element_wise(texto, pc.utf8_lpad(grupo, 3, '0'), '.'), grupo)
+        iniciado = pc.or_(iniciado, pa.array(reais >= 1000 ** k))
+
+    fracao = pc.utf8_lpad(pc.cast(pa.array(inteiros % 100), pa.string()), 2, '0')
+    sinal = pc.if_else(pa.array((numeros < 0) & (inteiros > 0)), '-', '')
+    formatado = pc.binary_join_element_wise('R$ ', sinal, texto, ',', fracao, '')
+    return pd.Series(formatado.to_numpy(zero_copy_only=False), index=serie.index, dtype=object).where(validos, np.nan)
@@ -0,0 +1,195 @@
+import json
+import os
+from contextlib import contextmanager
+import sqlite3
+import threading
+import time
+
+# Arquivo local (SQLite) compartilhado entre sessões e clientes
+DEFAULT_STORE_PATH = os.environ.get("HEDGEWISE_CLASSIFICACOES_DB", "classificacoes_aprendidas.sqlite3")
+
+# Escopo das classificações aprendidas a partir do Gemini (categoria_sugerida/categoria_dcf/entidade)
+ESCOPO_GEMINI = "gemini"
+CAMPOS_CLASSIFICACAO = ('categoria_sugerida', 'categoria_dcf', 'entidade')
+
+# Limite de parâmetros por consulta IN (o SQLite aceita no mínimo 999)
+_TAMANHO_LOTE = 500
+
+
+def _votos_legados(registro):
+    """Contagem de votos de um registro gravado antes da tabela 'votos' (sem contagem, vale um voto)."""
+    return registro.get('votos') or {campo: {registro[campo]: 1} for campo in CAMPOS_CLASSIFICACAO if registro.get(campo)}
+
+
+class ClassificationStore:
+    """Mapeamentos persistentes 'chave normalizada -> classificação', separados por escopo."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._conectar() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS classificacoes ("
+                " escopo TEXT NOT NULL,"
+                " chave TEXT NOT NULL,"
+                " valor TEXT NOT NULL,"
+                " atualizado_em REAL NOT NULL,"
+                " PRIMARY KEY (escopo, chave))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS votos ("
+                " escopo TEXT NOT NULL,"
+                " chave TEXT NOT NULL,"
+                " campo TEXT NOT NULL,"
+                " valor TEXT NOT NULL,"
+                " contagem INTEGER NOT NULL,"
+                " PRIMARY KEY (escopo, chave, campo, valor))"
+            )
+            # Razões (impressão digital) que já votaram em cada escopo
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS origens_votos ("
+                " escopo TEXT NOT NULL,"
+                " origem TEXT NOT NULL,"
+                " registrado_em REAL NOT NULL,"
+                " PRIMARY KEY (escopo, origem))"
+            )
+
+    @contextmanager
+    def _conectar(self):
+        # Uma conexão por operação: o Streamlit atende cada sessão em uma thread diferente
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _consultar_em_lotes(conn, consulta, parametros, chaves):
+        """Executa 'consulta' (com '{marcadores}' no lugar da lista IN) para as chaves, em lotes."""
+        for inicio in range(0, len(chaves), _TAMANHO_LOTE):
+            lote = chaves[inicio:inicio + _TAMANHO_LOTE]
+            yield from conn.execute(consulta.format(marcadores=",".join("?" * len(lote))), [*parametros, *lote])
+
+    def get_many(self, escopo, chaves, idade_max=None):
+        """Retorna {chave: classificação} para as chaves já aprendidas no escopo (gravadas há no
+        máximo 'idade_max' segundos, se informado)."""
+        chaves = list(dict.fromkeys(chaves))
+        desde = time.time() - idade_max if idade_max is not None else float('-inf')
+        with self._conectar() as conn:
+            cursor = self._consultar_em_lotes(
+                conn,
+                "SELECT chave, valor FROM classificacoes WHERE escopo = ? AND atualizado_em >= ? AND chave IN ({marcadores})",
+                [escopo, desde],
+                chaves,
+            )
+            return {chave: json.loads(valor) for chave, valor in cursor}
+
+    def put_many(self, escopo, registros):
+        """Grava (ou atualiza) as classificações {chave: classificação} do escopo."""
+        if not registros:
+            return
+        agora = time.time()
+        linhas = [(escopo, chave, json.dumps(valor, ensure_ascii=False), agora) for chave, valor in registros.items()]
+        with self._lock, self._conectar() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO classificacoes (escopo, chave, valor, atualizado_em) VALUES (?, ?, ?, ?)",
+                linhas,
+            )
+
+    def registrar_votos(self, escopo, classificacoes, origem=None):
+        """Soma um voto de cada classificação {chave: classificação} às chaves do escopo e retorna
+        {chave: registro atualizado}.
+
+        Cada campo do registro fica com o valor mais votado (em empate, o atual permanece): uma
+        resposta errada isolada é corrigida quando a mesma chave volta a ser classificada de outra
+        forma. Com 'origem' (ex: a impressão digital do razão que vota), cada origem vota uma única
+        vez por escopo; se já votou, nada muda e retorna {}. Contagem e vencedor são gravados na
+        mesma transação, com o banco travado para escrita, para que sessões simultâneas não percam votos.
+        """
+        chaves = list(classificacoes)
+        if not chaves:
+            return {}
+        agora = time.time()
+        with self._lock, self._conectar() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if origem is not None and not conn.execute(
+                "INSERT OR IGNORE INTO origens_votos (escopo, origem, registrado_em) VALUES (?, ?, ?)",
+                (escopo, origem, agora),
+            ).rowcount:
+                return {}
+
+            registros = {
+                chave: json.loads(valor)
+                for chave, valor in self._consultar_em_lotes(
+                    conn, "SELECT chave, valor FROM classificacoes WHERE escopo = ? AND chave IN ({marcadores})", [escopo], chaves
+                )
+            }
+            contadas = {
+                chave for (chave,) in self._consultar_em_lotes(
+                    conn, "SELECT DISTINCT chave FROM votos WHERE escopo = ? AND chave IN ({marcadores})", [escopo], chaves
+                )
+            }
+            # Registros gravados antes da tabela 'votos' entram com a contagem que tinham
+            conn.executemany(
+                "INSERT INTO votos (escopo, chave, campo, valor, contagem) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (escopo, chave, campo, valor, contagem)
+                    for chave, registro in registros.items() if chave not in contadas
+                    for campo, votos in _votos_legados(registro).items()
+                    for valor, contagem in votos.items()
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO votos (escopo, chave, campo, valor, contagem) VALUES (?, ?, ?, ?, 1)"
+                " ON CONFLICT (escopo, chave, campo, valor) DO UPDATE SET contagem = contagem + excluded.contagem",
+                [
+                    (escopo, chave, campo, valor)
+                    for chave, classificacao in classificacoes.items()
+                    for campo in CAMPOS_CLASSIFICACAO
+                    if isinstance(valor := classificacao.get(campo), str) and valor
+                ],
+            )
+
+            contagens = {}
+            for chave, campo, valor, contagem in self._consultar_em_lotes(
+                conn,
+                "SELECT chave, campo, valor, contagem FROM votos WHERE escopo = ? AND chave IN ({marcadores})"
+                " ORDER BY contagem DESC",
+                [escopo],
+                chaves,
+            ):
+                contagens.setdefault(chave, {}).setdefault(campo, {})[valor] = contagem
+
+            atualizados = {}
+            for chave in chaves:
+                registro = registros.get(chave, {})
+                registro.pop('votos', None)
+                for campo, votos in contagens.get(chave, {}).items():
+                    vencedor = next(iter(votos))
+                    if votos[vencedor] > votos.get(registro.get(campo), 0):
+                        registro[campo] = vencedor
+                atualizados[chave] = registro
+            conn.executemany(
+                "INSERT OR REPLACE INTO classificacoes (escopo, chave, valor, atualizado_em) VALUES (?, ?, ?, ?)",
+                [(escopo, chave, json.dumps(registro, ensure_ascii=False), agora) for chave, registro in atualizados.items()],
+            )
+        return atualizados
+
+    def purge(self, escopo, idade_max):
+        """Remove do escopo os registros gravados há mais de 'idade_max' segundos; retorna quantos."""
+        limite = time.time() - idade_max
+        with self._lock, self._conectar() as conn:
+            removidos = conn.execute(
+                "DELETE FROM classificacoes WHERE escopo = ? AND atualizado_em < ?", (escopo, limite)
+            ).rowcount
+            conn.execute(
+                "DELETE FROM votos WHERE escopo = ? AND chave NOT IN (SELECT chave FROM classificacoes WHERE escopo = ?)",
+                (escopo, escopo),
+            )
+            conn.execute("DELETE FROM origens_votos WHERE escopo = ? AND registrado_em < ?", (escopo, limite))
+            return removidos
+
+    def __len__(self):
+        with self._conectar() as conn:
+            return conn.execute("SELECT COUNT(*) FROM classificacoes").fetchone()[0]
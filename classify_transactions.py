@@ -1,6 +1,62 @@
 
+import re
+import unicodedata
+
+import numpy as np
 import pandas as pd
 
+# Versão das regras de classify_transaction. Incrementar ao alterar as regras,
+# para que as classificações já gravadas no store não sejam reaproveitadas.
+RULES_VERSION = 1
+ESCOPO_REGRAS = f"regras-v{RULES_VERSION}"
+
+# Padrões removidos na normalização das descrições
+_PADRAO_CNPJ = re.compile(r'\b\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}\b')
+_PADRAO_CPF = re.compile(r'\b\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b')
+_PADRAO_DATA = re.compile(r'\b\d{1,2}/\d{1,2}(?:/\d{2,4})?[a-z]?\b')
+_PADRAO_HORA = re.compile(r'\b\d{1,2}:\d{2}(?::\d{2})?\b')
+# Números de documento/agência/conta: sequências numéricas que não fazem parte de uma palavra (ex: '99pop')
+_PADRAO_NUMERO = re.compile(r'(?<![a-z])\d[\d.,/-]*(?![a-z\d])')
+_PADRAO_PONTUACAO = re.compile(r'[^a-z0-9 ]+')
+_PADRAO_ESPACOS = re.compile(r'\s+')
+
+# Categorias que classify_transaction pode produzir (usadas também como vocabulário do classificador em lote)
+CATEGORIES = (
+    "Receita", "Transferência Recebida", "Rendimentos/Investimentos", "Moradia", "Alimentação",
+    "Transporte", "Contas de Consumo", "Saúde", "Educação", "Lazer", "Taxas e Tarifas",
+    "Pagamento de Contas", "Transferência Enviada", "Investimentos/Aplicações",
+    "Pagamento de Salários/Fornecedores", "Débito Automático", "Saque", "Saldo Inicial", "Outros",
+)
+FLUXOS_DCF = ("OPERACIONAL", "INVESTIMENTO", "FINANCIAMENTO")
+ENTIDADES = ("EMPRESARIAL", "PESSOAL")
+
+# Valores aceitos em cada campo das classificações aprendidas (escopo Gemini do ClassificationStore)
+VOCABULARIO_CLASSIFICACAO = {'categoria_sugerida': CATEGORIES, 'categoria_dcf': FLUXOS_DCF, 'entidade': ENTIDADES}
+
+
+def normalize_description(description):
+    """Reduz a descrição a uma chave estável (sem acentos, datas, documentos e CNPJ/CPF)."""
+    texto = unicodedata.normalize('NFKD', str(description).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    for padrao in (_PADRAO_CNPJ, _PADRAO_CPF, _PADRAO_DATA, _PADRAO_HORA, _PADRAO_NUMERO):
+        texto = padrao.sub(' ', texto)
+    texto = _PADRAO_PONTUACAO.sub(' ', texto)
+    return _PADRAO_ESPACOS.sub(' ', texto).strip()
+
+
+def normalize_descriptions(descriptions):
+    """Normaliza uma Series de descrições, processando cada descrição distinta uma única vez."""
+    descriptions = descriptions.fillna('').astype(str)
+    unicas = pd.unique(descriptions)
+    return descriptions.map(dict(zip(unicas, map(normalize_description, unicas))))
+
+
+def classification_keys(descriptions, credito):
+    """Chaves de memoização 'C|descricao normalizada' / 'D|...' (a direção influencia a classificação)."""
+    direcao = np.where(np.asarray(credito, dtype=bool), 'C|', 'D|')
+    return pd.Series(direcao, index=descriptions.index) + normalize_descriptions(descriptions)
+
+
 def classify_transaction(description, value):
     description = str(description).lower()
     category = "Outros"
@@ -48,8 +104,30 @@ def classify_transaction(description, value):
 
     return category
 
-def add_category_column(df):
-    df["Categoria"] = df.apply(lambda row: classify_transaction(row["Histórico"], row["Valor"]), axis=1)
+def classify_descriptions(descriptions, values, store=None):
+    """Classifica uma Series de descrições pelas regras, uma única vez por chave normalizada distinta."""
+    chaves = classification_keys(descriptions, values > 0)
+    unicas = pd.unique(chaves)
+
+    categorias = {}
+    if store is not None:
+        categorias = {chave: valor['Categoria'] for chave, valor in store.get_many(ESCOPO_REGRAS, unicas).items()}
+
+    novas = {}
+    for chave in unicas:
+        if chave not in categorias:
+            direcao, descricao = chave.split('|', 1)
+            novas[chave] = classify_transaction(descricao, 1 if direcao == 'C' else -1)
+    categorias.update(novas)
+
+    if store is not None:
+        store.put_many(ESCOPO_REGRAS, {chave: {'Categoria': categoria} for chave, categoria in novas.items()})
+
+    return chaves.map(categorias)
+
+def add_category_column(df, store=None):
+    # As regras rodam uma vez por chave normalizada distinta; o resultado é mapeado de volta às linhas
+    df["Categoria"] = classify_descriptions(df["Histórico"], df["Valor"], store)
     return df
 
 
@@ -0,0 +1,123 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal
+
+from google.genai import types
+from pydantic import BaseModel, Field, ValidationError
+
+from classification_store import CAMPOS_CLASSIFICACAO, ESCOPO_GEMINI
+from classify_transactions import CATEGORIES, ENTIDADES, FLUXOS_DCF
+
+MODELO_CLASSIFICACAO = 'gemini-2.5-flash'
+
+# Orçamento de tokens de entrada por requisição e limite de itens (mantém a resposta curta)
+ORCAMENTO_TOKENS_LOTE = 4000
+MAX_ITENS_LOTE = 250
+# Estimativa simples de tokens (~4 caracteres por token), suficiente para dimensionar os lotes
+CHARS_POR_TOKEN = 4
+MAX_REQUISICOES_SIMULTANEAS = 4
+
+
+class ClassificacaoItem(BaseModel):
+    """Classificação de uma descrição do lote (nomes curtos para reduzir tokens de saída)."""
+    i: int = Field(description="Índice da descrição na lista recebida.")
+    # Enums no schema: o modelo só pode responder com o vocabulário do classificador
+    cat: Literal[CATEGORIES] = Field(description="Categoria da transação, escolhida da lista de categorias permitidas.")
+    dcf: Literal[FLUXOS_DCF] = Field(description="'OPERACIONAL', 'INVESTIMENTO' ou 'FINANCIAMENTO'.")
+    ent: Literal[ENTIDADES] = Field(description="'EMPRESARIAL' ou 'PESSOAL'.")
+
+
+class ClassificacaoLote(BaseModel):
+    """Resposta estruturada de um lote de descrições."""
+    itens: List[ClassificacaoItem] = Field(description="Uma classificação para cada descrição recebida.")
+
+
+def _estimar_tokens(texto):
+    return len(texto) // CHARS_POR_TOKEN + 1
+
+
+def _linha_prompt(indice, chave):
+    direcao, descricao = chave.split('|', 1)
+    return f"{indice}\t{'CREDITO' if direcao == 'C' else 'DEBITO'}\t{descricao}"
+
+
+def chunk_keys(chaves, token_budget=ORCAMENTO_TOKENS_LOTE, max_itens=MAX_ITENS_LOTE):
+    """Agrupa as chaves em lotes cujo texto cabe no orçamento de tokens."""
+    lotes, atual, tokens = [], [], 0
+    for chave in chaves:
+        custo = _estimar_tokens(_linha_prompt(len(atual), chave))
+        if atual and (tokens + custo > token_budget or len(atual) >= max_itens):
+            lotes.append(atual)
+            atual, tokens = [], 0
+        atual.append(chave)
+        tokens += custo
+    if atual:
+        lotes.append(atual)
+    return lotes
+
+
+def _classificar_lote(chaves, client):
+    linhas = "\n".join(_linha_prompt(i, chave) for i, chave in enumerate(chaves))
+    prompt = (
+        "Classifique cada transação bancária abaixo (formato: índice, tipo, descrição normalizada). "
+        f"Categorias permitidas: {', '.join(CATEGORIES)}. "
+        "Classifique também 'dcf' ('OPERACIONAL', 'INVESTIMENTO' ou 'FINANCIAMENTO') e 'ent' ('EMPRESARIAL' ou 'PESSOAL'); "
+        "a maioria das movimentações é EMPRESARIAL, mas retiradas de sócios e gastos pessoais são PESSOAL. "
+        "Responda um item por índice, sem repetir a descrição.\n\n"
+        f"{linhas}"
+    )
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=ClassificacaoLote,
+        temperature=0.0,
+    )
+    response = client.models.generate_content(model=MODELO_CLASSIFICACAO, contents=[prompt], config=config)
+    itens = json.loads(response.text).get('itens') or []
+
+    resultado, erros = {}, []
+    for bruto in itens:
+        # Um item fora do vocabulário é descartado sem invalidar o restante do lote
+        try:
+            item = ClassificacaoItem.model_validate(bruto)
+        except ValidationError as e:
+            erros.append(f"Classificação descartada (fora do vocabulário): {bruto} ({e.error_count()} erro(s))")
+            continue
+        if 0 <= item.i < len(chaves):
+            resultado[chaves[item.i]] = {'categoria_sugerida': item.cat, 'categoria_dcf': item.dcf, 'entidade': item.ent}
+    return resultado, erros
+
+
+def classify_keys_batch(chaves, client, store=None, token_budget=ORCAMENTO_TOKENS_LOTE,
+                        max_workers=MAX_REQUISICOES_SIMULTANEAS, erros=None):
+    """Classifica chaves normalizadas em lotes concorrentes; retorna {chave: classificação}.
+
+    Lotes com falha e itens fora do vocabulário não interrompem os demais: as chaves afetadas ficam
+    sem classificação e os problemas são descritos em 'erros' (lista, se informada).
+    """
+    chaves = list(dict.fromkeys(chaves))
+    resultado = store.get_many(ESCOPO_GEMINI, chaves) if store is not None else {}
+    # Registros aprendidos só com parte dos campos (ex: categoria livre da extração) também vão ao modelo
+    pendentes = [chave for chave in chaves if not all(resultado.get(chave, {}).get(campo) for campo in CAMPOS_CLASSIFICACAO)]
+    if not pendentes:
+        return resultado
+
+    lotes = chunk_keys(pendentes, token_budget)
+    novas = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = [executor.submit(_classificar_lote, lote, client) for lote in lotes]
+        for lote, futuro in zip(lotes, futuros):
+            try:
+                classificadas, descartadas = futuro.result()
+            except Exception as e:
+                descartadas = [f"Erro ao classificar lote de {len(lote)} descrições na Gemini API: {e}"]
+            else:
+                novas.update(classificadas)
+            if erros is not None:
+                erros.extend(descartadas)
+
+    # Cada resposta é um voto a mais para a chave: o app pode corrigi-la por maioria depois
+    if store is not None:
+        novas = store.registrar_votos(ESCOPO_GEMINI, novas)
+    resultado.update(novas)
+    return resultado
+
@@ -0,0 +1,263 @@
+import os
+import secrets
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from generate_reports import build_cash_flow_cube, generate_cash_flow_report, generate_monthly_cash_flow
+
+# Linhas por bloco escrito: limita a memória da serialização independentemente do tamanho do razão
+CHUNK_ROWS = 50_000
+
+FORMATOS_EXPORTACAO = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'ofx': 'application/x-ofx',
+}
+
+# Rota HTTP de download em streaming (montada por serve.py) e validade de cada exportação registrada
+ROTA_EXPORTACAO = '/exportacao'
+TTL_EXPORTACAO = 600
+
+# Exportações aguardando download pela rota: token -> (caminho, nome do arquivo, mime, expira em)
+_exportacoes = {}
+_lock_exportacoes = threading.Lock()
+_rota_ativa = False
+
+# Colunas do DataFrame do app -> nomes usados por generate_reports
+COLUNAS_RELATORIO = {
+    'data': 'Data',
+    'descricao': 'Histórico',
+    'fluxo_caixa': 'Valor',
+    'categoria_sugerida': 'Categoria',
+    'categoria_dcf': 'DCF',
+    'entidade': 'Entidade',
+}
+
+
+def iter_chunks(df, chunk_rows=CHUNK_ROWS):
+    for inicio in range(0, len(df), chunk_rows):
+        yield df.iloc[inicio:inicio + chunk_rows]
+
+
+def ledger_cube(df_transacoes):
+    """Cubo de fluxo de caixa do razão do app, com as dimensões nomeadas como em generate_reports.
+
+    Só as colunas do cubo são renomeadas (a descrição e as demais colunas não são copiadas).
+    """
+    colunas = [c for c in COLUNAS_RELATORIO if c in df_transacoes.columns and c != 'descricao']
+    return build_cash_flow_cube(df_transacoes[colunas].rename(columns=COLUNAS_RELATORIO))
+
+
+def report_frames(df_transacoes, cube=None):
+    """Saídas de generate_reports para o razão do app (todas a partir de um único cubo)."""
+    cube = cube if cube is not None else ledger_cube(df_transacoes)
+    receitas, despesas, saldo_total = generate_cash_flow_report(None, cube)
+    return {
+        'Receitas': receitas,
+        'Despesas': despesas,
+        'Mensal': generate_monthly_cash_flow(None, cube).reset_index().astype({'AnoMes': str}),
+        'Saldo Acumulado': cube.saldo_acumulado('M').reset_index().astype({'AnoMes': str}),
+        'Resumo': pd.DataFrame({'Saldo Total': [saldo_total]}),
+    }
+
+
+def write_csv(df, destino, chunk_rows=CHUNK_ROWS):
+    """CSV no padrão brasileiro (';' e vírgula decimal), escrito em blocos em um arquivo binário."""
+    destino.write('\ufeff'.encode('utf-8'))  # BOM para o Excel reconhecer UTF-8
+    for i, chunk in enumerate(iter_chunks(df, chunk_rows)):
+        texto = chunk.to_csv(
+            index=False, header=(i == 0), sep=';', decimal=',', date_format='%d/%m/%Y', float_format='%.2f'
+        )
+        destino.write(texto.encode('utf-8'))
+    if df.empty:
+        destino.write(df.to_csv(index=False, sep=';').encode('utf-8'))
+
+
+def write_xlsx(planilhas, destino, chunk_rows=CHUNK_ROWS):
+    """XLSX em modo write-only do openpyxl (as linhas são gravadas e descartadas em sequência)."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for nome, df in planilhas.items():
+        planilha = workbook.create_sheet(title=nome[:31])
+        planilha.append([str(coluna) for coluna in df.columns])
+        for chunk in iter_chunks(df, chunk_rows):
+            # Conversão em bloco: NaN/NaT viram células vazias
+            valores = chunk.astype(object).where(chunk.notna(), None)
+            for linha in valores.itertuples(index=False, name=None):
+                planilha.append(linha)
+    workbook.save(destino)
+
+
+def write_parquet(df, destino, chunk_rows=CHUNK_ROWS):
+    """Parquet escrito em row groups, um por bloco."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(destino, schema) as writer:
+        for chunk in iter_chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+# OFX 1.02 (SGML): sign-on + extrato bancário com STATUS, conta, lista de transações e saldo
+# OFX 1.02 só admite ENCODING:USASCII (com CHARSET:1252 para acentos) ou UNICODE; UTF-8 é inválido
+CODIFICACAO_OFX = 'cp1252'
+_CABECALHO_OFX = (
+    "OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nSECURITY:NONE\nENCODING:USASCII\nCHARSET:1252\n"
+    "COMPRESSION:NONE\nOLDFILEUID:NONE\nNEWFILEUID:NONE\n\n"
+    "<OFX>\n<SIGNONMSGSRSV1>\n<SONRS>\n<STATUS>\n<CODE>0\n<SEVERITY>INFO\n</STATUS>\n"
+    "<DTSERVER>{agora}\n<LANGUAGE>POR\n</SONRS>\n</SIGNONMSGSRSV1>\n"
+    "<BANKMSGSRSV1>\n<STMTTRNRS>\n<TRNUID>1\n<STATUS>\n<CODE>0\n<SEVERITY>INFO\n</STATUS>\n"
+    "<STMTRS>\n<CURDEF>BRL\n"
+    "<BANKACCTFROM>\n<BANKID>{banco}\n<ACCTID>{conta}\n<ACCTTYPE>CHECKING\n</BANKACCTFROM>\n"
+    "<BANKTRANLIST>\n<DTSTART>{inicio}\n<DTEND>{fim}\n"
+)
+_RODAPE_OFX = (
+    "</BANKTRANLIST>\n<LEDGERBAL>\n<BALAMT>{saldo}\n<DTASOF>{fim}\n</LEDGERBAL>\n"
+    "</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n"
+)
+# Identificação da conta quando o razão não traz banco/conta (ex: extratos de vários bancos consolidados)
+BANCO_OFX_PADRAO = '0000'
+CONTA_OFX_PADRAO = 'CONSOLIDADO'
+
+
+def _escapar_sgml(serie):
+    return (
+        serie.fillna('').astype(str)
+        .str.replace('&', '&amp;', regex=False)
+        .str.replace('<', '&lt;', regex=False)
+        .str.replace('>', '&gt;', regex=False)
+        .str.replace('\n', ' ', regex=False)
+    )
+
+
+def write_ofx(df, destino, date_col='data', value_col='fluxo_caixa', memo_col='descricao', chunk_rows=CHUNK_ROWS,
+              banco=BANCO_OFX_PADRAO, conta=CONTA_OFX_PADRAO, saldo_inicial=0.0):
+    """OFX 1.02 (SGML, Windows-1252) com um STMTTRN por transação; valores com sinal (crédito positivo).
+
+    Linhas sem data ou com valor não finito (NaN/inf) não têm representação em OFX e são
+    descartadas (com aviso). O razão não guarda saldos: BALAMT é 'saldo_inicial' + fluxo do período.
+    Caracteres fora do Windows-1252 saem como '?'.
+    """
+    valores = pd.to_numeric(df[value_col], errors='coerce').astype(float)
+    datas = pd.to_datetime(df[date_col], errors='coerce')
+    validas = np.isfinite(valores.to_numpy()) & datas.notna().to_numpy()
+    if not validas.all():
+        print(f"OFX: {int((~validas).sum())} transação(ões) sem data ou valor válido descartada(s).")
+        df, valores, datas = df[validas], valores[validas], datas[validas]
+
+    inicio = datas.min().strftime('%Y%m%d') if len(df) else ''
+    fim = datas.max().strftime('%Y%m%d') if len(df) else ''
+    destino.write(_CABECALHO_OFX.format(
+        agora=pd.Timestamp.now().strftime('%Y%m%d%H%M%S'), banco=banco, conta=conta, inicio=inicio, fim=fim,
+    ).encode(CODIFICACAO_OFX, errors='replace'))
+
+    for chunk in iter_chunks(df, chunk_rows):
+        valores_chunk = valores.loc[chunk.index]
+        fitid = pd.util.hash_pandas_object(chunk[[date_col, memo_col, value_col]], index=True).astype(str)
+        blocos = (
+            "<STMTTRN>\n<TRNTYPE>" + pd.Series(np.where(valores_chunk >= 0, 'CREDIT', 'DEBIT'), index=chunk.index)
+            + "\n<DTPOSTED>" + datas.loc[chunk.index].dt.strftime('%Y%m%d')
+            + "\n<TRNAMT>" + pd.Series(np.char.mod('%.2f', valores_chunk.to_numpy()), index=chunk.index)
+            + "\n<FITID>" + fitid
+            + "\n<MEMO>" + _escapar_sgml(chunk[memo_col])
+            + "\n</STMTTRN>\n"
+        )
+        destino.write(''.join(blocos.tolist()).encode(CODIFICACAO_OFX, errors='replace'))
+
+    destino.write(_RODAPE_OFX.format(saldo=f"{saldo_inicial + valores.sum():.2f}", fim=fim).encode(CODIFICACAO_OFX, errors='replace'))
+
+
+def export_to_file(df_transacoes, formato, diretorio=None, cube=None):
+    """Exporta o razão (e, no XLSX, os relatórios) para um arquivo temporário e retorna o caminho.
+
+    'cube' (de ledger_cube) evita reagregar as transações quando o chamador já o tem em cache.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação '{formato}' inválido. Use um de {list(FORMATOS_EXPORTACAO)}.")
+
+    descritor, caminho = tempfile.mkstemp(suffix=f'.{formato}', dir=diretorio)
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            if formato == 'csv':
+                write_csv(df_transacoes, destino)
+            elif formato == 'xlsx':
+                write_xlsx({'Transações': df_transacoes, **report_frames(df_transacoes, cube)}, destino)
+            elif formato == 'parquet':
+                write_parquet(df_transacoes, destino)
+            else:
+                write_ofx(df_transacoes, destino)
+    except Exception:
+        os.remove(caminho)
+        raise
+    return caminho
+
+
+def export_bytes(df_transacoes, formato, diretorio=None, cube=None):
+    """Gera a exportação em disco (em blocos) e devolve o conteúdo; o arquivo temporário é removido.
+
+    Para st.download_button, que guarda o retorno em memória (media storage do Streamlit): a
+    serialização não duplica o razão, mas o arquivo final fica inteiro em RAM até o download.
+    Com serve.py, prefira export_to_file + register_export (download em streaming).
+    """
+    caminho = export_to_file(df_transacoes, formato, diretorio, cube)
+    try:
+        with open(caminho, 'rb') as arquivo:
+            return arquivo.read()
+    finally:
+        os.remove(caminho)
+
+
+def enable_streaming_route():
+    """Marca que a rota ROTA_EXPORTACAO está montada no servidor (chamado por serve.py)."""
+    global _rota_ativa
+    _rota_ativa = True
+
+
+def streaming_route_enabled():
+    return _rota_ativa
+
+
+def _remover_expiradas(agora):
+    for token, (caminho, _, _, expira_em) in list(_exportacoes.items()):
+        if expira_em <= agora:
+            del _exportacoes[token]
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+
+def register_export(caminho, nome_arquivo, mime, ttl=TTL_EXPORTACAO):
+    """Disponibiliza um arquivo exportado para um único download pela rota; retorna o token da URL.
+
+    Exportações não baixadas dentro de 'ttl' segundos são removidas do disco.
+    """
+    token = secrets.token_urlsafe(24)
+    with _lock_exportacoes:
+        _remover_expiradas(time.monotonic())
+        _exportacoes[token] = (caminho, nome_arquivo, mime, time.monotonic() + ttl)
+    return token
+
+
+def take_export(token):
+    """Retira a exportação do registro (uso único): (caminho, nome do arquivo, mime) ou None."""
+    with _lock_exportacoes:
+        _remover_expiradas(time.monotonic())
+        exportacao = _exportacoes.pop(token, None)
+    return exportacao[:3] if exportacao is not None else None
+
+
+def iter_file(caminho, tamanho_bloco=1024 * 1024, remover=True):
+    """Lê o arquivo exportado em blocos (para respostas HTTP em streaming) e o remove ao final."""
+    try:
+        with open(caminho, 'rb') as arquivo:
+            while bloco := arquivo.read(tamanho_bloco):
+                yield bloco
+    finally:
+        if remover and os.path.exists(caminho):
+            os.remove(caminho)
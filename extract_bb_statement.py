@@ -2,6 +2,22 @@
 import pandas as pd
 import re
 
+from brl_codec import parse_brl
+
+
+def _montar_dataframe(transactions):
+    """Converte os valores capturados (texto) de uma vez com brl_codec e aplica o sinal dos débitos ('D').
+
+    Valores que não puderam ser interpretados são informados e a linha é descartada.
+    """
+    df = pd.DataFrame(transactions, columns=['Data', 'Histórico', 'Valor', 'Tipo'])
+    valores = parse_brl(df['Valor'], errors='coerce')
+    invalidos = valores.isna() & df['Valor'].notna()
+    if invalidos.any():
+        print(f"Aviso: {int(invalidos.sum())} transação(ões) ignorada(s) por valor inválido: {df.loc[invalidos, 'Valor'].head().tolist()}")
+    df['Valor'] = valores.where(df['Tipo'] != 'D', -valores)
+    return df[~invalidos].drop(columns='Tipo').reset_index(drop=True)
+
 def extract_bb_statement(markdown_content):
     lines = markdown_content.split("\n")
     transactions = []
@@ -26,26 +42,15 @@ def extract_bb_statement(markdown_content):
             date_str = match_bb.group(1)
             current_date = pd.to_datetime(date_str, format='%d/%m/%Y')
             description = match_bb.group(2).strip()
-            value_str = match_bb.group(3).replace('.', '').replace(',', '.')
-            value_type = match_bb.group(4)
-            value = float(value_str)
-            if value_type == 'D':
-                value *= -1
-            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': value})
+            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': match_bb.group(3), 'Tipo': match_bb.group(4)})
         else:
             # Tenta encontrar transações sem data explícita na linha, usando a última data conhecida
             match_bb_no_date = transaction_pattern_bb_no_date.search(line)
             if match_bb_no_date and current_date:
                 description = match_bb_no_date.group(1).strip()
-                value_str = match_bb_no_date.group(2).replace('.', '').replace(',', '.')
-                value_type = match_bb_no_date.group(3)
-                value = float(value_str)
-                if value_type == 'D':
-                    value *= -1
-                transactions.append({'Data': current_date, 'Histórico': description, 'Valor': value})
+                transactions.append({'Data': current_date, 'Histórico': description, 'Valor': match_bb_no_date.group(2), 'Tipo': match_bb_no_date.group(3)})
 
-    df = pd.DataFrame(transactions)
-    return df
+    return _montar_dataframe(transactions)
 
 def extract_caixa_statement(markdown_content):
     lines = markdown_content.split("\n")
@@ -78,12 +83,7 @@ def extract_caixa_statement(markdown_content):
             date_str = match_table.group(1)
             current_date = pd.to_datetime(date_str, format='%d/%m/%Y')
             description = match_table.group(2).strip()
-            value_str = match_table.group(3).replace('.', '').replace(',', '.')
-            value_type = match_table.group(4)
-            value = float(value_str)
-            if value_type == 'D':
-                value *= -1
-            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': value})
+            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': match_table.group(3), 'Tipo': match_table.group(4)})
         else:
             # Se não for uma linha de tabela, tenta encontrar a data no início da linha
             date_match = re.match(r'^(\d{2}/\d{2}/\d{4})', line)
@@ -103,19 +103,13 @@ def extract_caixa_statement(markdown_content):
                     if match_item:
                         # O grupo 1 é o número do documento opcional, o grupo 2 é o histórico
                         description = match_item.group(2).strip()
-                        value_str = match_item.group(3).replace('.', '').replace(',', '.')
-                        value_type = match_item.group(4)
-                        value = float(value_str)
-                        if value_type == 'D':
-                            value *= -1
-                        transactions.append({'Data': current_date, 'Histórico': description, 'Valor': value})
+                        transactions.append({'Data': current_date, 'Histórico': description, 'Valor': match_item.group(3), 'Tipo': match_item.group(4)})
                         # Remove a transação encontrada da linha para procurar a próxima
                         temp_line = temp_line[match_item.end(0):].strip()
                     else:
                         break
 
-    df = pd.DataFrame(transactions)
-    return df
+    return _montar_dataframe(transactions)
 
 
 # Funções para os novos extratos (MLGITA e MLGSAN)
@@ -147,12 +141,10 @@ def extract_mlgita_statement(markdown_content):
             date_str = f"{day}/{month_num}/2024"
             current_date = pd.to_datetime(date_str, format='%d/%m/%Y')
             description = match.group(3).strip()
-            value_str = match.group(4).replace('.', '').replace(',', '.')
-            value = float(value_str)
-            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': value})
+            # O sinal já vem no próprio valor (débitos negativos)
+            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': match.group(4)})
 
-    df = pd.DataFrame(transactions)
-    return df
+    return _montar_dataframe(transactions)
 
 def extract_mlgsan_statement(markdown_content):
     lines = markdown_content.split("\n")
@@ -174,12 +166,10 @@ def extract_mlgsan_statement(markdown_content):
             date_str = match.group(1)
             current_date = pd.to_datetime(date_str, format='%d/%m/%Y')
             description = match.group(2).strip()
-            value_str = match.group(3).replace('.', '').replace(',', '.')
-            value = float(value_str)
-            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': value})
+            # O sinal já vem no próprio valor (débitos negativos)
+            transactions.append({'Data': current_date, 'Histórico': description, 'Valor': match.group(3)})
 
-    df = pd.DataFrame(transactions)
-    return df
+    return _montar_dataframe(transactions)
 
 
 
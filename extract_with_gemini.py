@@ -0,0 +1,382 @@
+import hashlib
+import io
+from collections import OrderedDict
+from typing import Any, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+from google.genai import errors, types
+from pydantic import BaseModel, Field, ValidationError
+
+from gemini_scheduler import estimar_tokens
+from parse_json_stream import JsonArrayStreamParser
+
+MODELO_EXTRACAO = 'gemini-2.5-flash'
+MODELO_RELATORIO = 'gemini-2.5-flash'
+
+# Cache de contexto do relatório: mínimo de tokens aceito pela API para o modelo e validade do cache
+MIN_TOKENS_CACHE_EXPLICITO = 1024
+TTL_CACHE_RELATORIO = '3600s'
+# Relatórios memorizados por sessão (pares razão/contexto mais recentes)
+MAX_RELATORIOS_MEMORIZADOS = 16
+
+# Colunas enviadas ao modelo no relatório consolidado
+COLUNAS_RELATORIO_LLM = [
+    'data', 'descricao', 'valor', 'tipo_movimentacao',
+    'categoria_sugerida', 'categoria_dcf', 'entidade',
+]
+
+
+# --- SCHEMA PYDANTIC (Estrutura de Saída) ---
+
+class Transacao(BaseModel):
+    """Representa uma única transação no extrato bancário."""
+    data: str = Field(
+        description="A data da transação no formato 'DD/MM/AAAA' ou 'AAAA-MM-DD'."
+    )
+    descricao: str = Field(
+        description="Descrição detalhada da transação, como o nome do estabelecimento ou tipo de serviço."
+    )
+    valor: float = Field(
+        description="O valor numérico da transação. Sempre positivo. Ex: 150.75"
+    )
+    tipo_movimentacao: str = Field(
+        description="Classificação da movimentação: 'DEBITO' ou 'CREDITO'."
+    )
+    categoria_sugerida: str = Field(
+        description="Sugestão de categoria mais relevante para esta transação (Ex: 'Alimentação', 'Transporte', 'Salário', 'Investimento', 'Serviços')."
+    )
+    categoria_dcf: str = Field(
+        description="Classificação da transação para o Demonstrativo de Fluxo de Caixa (DCF): 'OPERACIONAL', 'INVESTIMENTO' ou 'FINANCIAMENTO'."
+    )
+    entidade: str = Field(
+        description="Classificação binária para identificar a origem/destino da movimentação: 'EMPRESARIAL' (relacionada ao negócio) ou 'PESSOAL' (retiradas dos sócios ou gastos pessoais detectados)."
+    )
+
+
+class ExtratoBancarioCompleto(BaseModel):
+    """Contém a lista de transações e o relatório de análise."""
+    transacoes: List[Transacao] = Field(
+        description="Uma lista de objetos 'Transacao' extraídos do documento."
+    )
+    saldo_final: float = Field(
+        description="O saldo final da conta no extrato. Use zero se não for encontrado."
+    )
+    relatorio_analise: str = Field(
+        description="Confirmação de extração dos dados deste extrato. Use 'Extração de dados concluída com sucesso.'"
+    )
+
+
+# Mesmos campos de Transacao, como colunas Arrow (str -> string, float -> float64)
+_TIPOS_ARROW = {str: pa.string(), float: pa.float64()}
+SCHEMA_TRANSACAO = pa.schema([(campo, _TIPOS_ARROW[info.annotation]) for campo, info in Transacao.model_fields.items()])
+_SCHEMA_EXTRATO = pa.schema([
+    ('transacoes', pa.list_(pa.struct(SCHEMA_TRANSACAO))),
+    ('saldo_final', pa.float64()),
+    ('relatorio_analise', pa.string()),
+])
+
+
+class _EnvelopeExtrato(BaseModel):
+    """ExtratoBancarioCompleto sem validar as transações (validadas uma a uma no caminho lento)."""
+    transacoes: List[Any]
+    saldo_final: float
+    relatorio_analise: str
+
+
+# --- DECODIFICAÇÃO DA RESPOSTA ---
+
+def _decodificar_arrow(texto):
+    # read_json lê um documento por linha; em JSON, quebras de linha fora de strings são só espaço
+    # (dentro de strings elas vêm sempre escapadas)
+    bruto = texto.encode('utf-8').replace(b'\r', b' ').replace(b'\n', b' ')
+    tabela = pa_json.read_json(
+        io.BytesIO(bruto),
+        read_options=pa_json.ReadOptions(block_size=len(bruto) + 1),
+        parse_options=pa_json.ParseOptions(explicit_schema=_SCHEMA_EXTRATO, unexpected_field_behavior='ignore'),
+    )
+    if tabela.num_rows != 1:
+        raise ValueError("A resposta deve conter um único objeto JSON.")
+    saldo_final, relatorio_analise = tabela['saldo_final'][0].as_py(), tabela['relatorio_analise'][0].as_py()
+    if saldo_final is None or relatorio_analise is None:
+        raise ValueError("Envelope do extrato incompleto.")
+
+    transacoes = pa.Table.from_struct_array(tabela['transacoes'].combine_chunks().flatten())
+    # Campos obrigatórios ausentes ou nulos chegam como null: a transação inteira é descartada
+    nulos = {campo: pc.is_null(transacoes[campo]).to_numpy(zero_copy_only=False) for campo in SCHEMA_TRANSACAO.names}
+    invalidas = np.logical_or.reduce(list(nulos.values()))
+    erros = [
+        f"Transação {indice}: campo(s) ausente(s) ou nulo(s) — {', '.join(campo for campo, mascara in nulos.items() if mascara[indice])}"
+        for indice in np.flatnonzero(invalidas)
+    ]
+    if erros:
+        transacoes = transacoes.filter(pa.array(~invalidas))
+    return transacoes, saldo_final, relatorio_analise, erros
+
+
+def _decodificar_por_transacao(texto):
+    envelope = _EnvelopeExtrato.model_validate_json(texto)
+    linhas, erros = [], []
+    for indice, objeto in enumerate(envelope.transacoes):
+        try:
+            linhas.append(Transacao.model_validate(objeto).model_dump())
+        except ValidationError as e:
+            erros.extend(
+                f"Transação {indice}: {'.'.join(str(parte) for parte in erro['loc']) or 'objeto'} — {erro['msg']}"
+                for erro in e.errors()
+            )
+    return pa.Table.from_pylist(linhas, schema=SCHEMA_TRANSACAO), envelope.saldo_final, envelope.relatorio_analise, erros
+
+
+def decodificar_extrato(texto: str) -> dict:
+    """Valida a resposta JSON da extração e a converte direto em colunas ('transacoes' é uma pyarrow.Table).
+
+    O caminho rápido (pyarrow.json com o schema de Transacao) não cria objetos Python por transação.
+    Se o JSON não couber no schema (ex: 'valor' como texto), cada transação é validada pelo pydantic.
+    Transações inválidas são descartadas e descritas em 'erros_validacao'; um envelope inválido
+    (JSON malformado, 'saldo_final' ou 'relatorio_analise' ausentes) levanta exceção.
+    """
+    try:
+        transacoes, saldo_final, relatorio_analise, erros = _decodificar_arrow(texto)
+    except (ValueError, TypeError):  # pa.ArrowInvalid / pa.ArrowTypeError herdam destas
+        transacoes, saldo_final, relatorio_analise, erros = _decodificar_por_transacao(texto)
+    return {
+        'transacoes': transacoes,
+        'saldo_final': saldo_final,
+        'relatorio_analise': relatorio_analise,
+        'erros_validacao': erros,
+    }
+
+
+# --- EXTRAÇÃO ---
+
+def texto_pagina(page) -> str:
+    """Texto e tabelas de uma página do pdfplumber."""
+    # Extrair texto da página
+    partes = [page.extract_text(x_tolerance=2) or ""]
+
+    # Extrair tabelas da página
+    tables = page.extract_tables()
+    for table in tables:
+        table_str = "\n".join(["\t".join(row) for row in table if row])
+        if table_str:
+            partes.append("\n--- TABELA INÍCIO ---\n" + table_str + "\n--- TABELA FIM ---\n")
+    return "\n".join(partes)
+
+
+def montar_requisicao_extracao(extracted_text: str, filename: str, contexto: str = None) -> tuple:
+    """Monta o conteúdo e a configuração da requisição de extração (usados nos modos normal e streaming).
+
+    'contexto' é o cabeçalho do extrato (banco, conta, período) quando o texto é só uma das páginas:
+    sem ele, datas sem ano e a conta de páginas intermediárias ficam ambíguas.
+    """
+    prompt_analise = (
+        f"Você é um especialista em extração e classificação de dados financeiros. "
+        f"Seu trabalho é extrair todas as transações deste extrato bancário fornecido como TEXTO do arquivo '{filename}' e "
+        "classificar cada transação rigorosamente em uma 'categoria_dcf' ('OPERACIONAL', 'INVESTIMENTO' ou 'FINANCIAMENTO') E "
+        "em uma 'entidade' ('EMPRESARIAL' ou 'PESSOAL'). "
+        "Use o contexto de que a maioria das movimentações devem ser EMPRESARIAIS, mas qualquer retirada para sócios, pagamento de contas pessoais ou compras não relacionadas ao CNPJ deve ser classificada como PESSOAL. "
+        "Não gere relatórios. Preencha apenas a estrutura JSON rigorosamente. "
+        "Use sempre o valor positivo para 'valor' e classifique estritamente como 'DEBITO' ou 'CREDITO'."
+    )
+
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=ExtratoBancarioCompleto,
+        temperature=0.2  # Baixa temperatura para foco na extração
+    )
+    if not contexto:
+        return [extracted_text, prompt_analise], config
+    # O cabeçalho vem primeiro: é igual em todas as páginas do arquivo (prefixo comum para o cache implícito)
+    cabecalho = (
+        "Cabeçalho do extrato (página 1), apenas como contexto — não extraia transações dele:\n"
+        f"{contexto}\n\nO texto a seguir é uma página deste extrato; use o período do cabeçalho para completar datas sem ano."
+    )
+    return [cabecalho, extracted_text, prompt_analise], config
+
+
+def extrair_extrato(extracted_text: str, filename: str, client, contexto: str = None) -> dict:
+    """Extrai e classifica as transações do texto do extrato (ver decodificar_extrato para o formato do resultado).
+
+    Erros da API e envelopes inválidos são propagados.
+    """
+    contents, config = montar_requisicao_extracao(extracted_text, filename, contexto)
+    response = client.models.generate_content(model=MODELO_EXTRACAO, contents=contents, config=config)
+    return decodificar_extrato(response.text)
+
+
+def extrair_extrato_stream(extracted_text: str, filename: str, client, ao_receber_transacoes, contexto: str = None) -> dict:
+    """Versão em streaming de extrair_extrato: entrega as transações parciais a 'ao_receber_transacoes'
+    à medida que chegam e decodifica a resposta completa com decodificar_extrato no final."""
+    contents, config = montar_requisicao_extracao(extracted_text, filename, contexto)
+
+    parser = JsonArrayStreamParser('transacoes')
+    for chunk in client.models.generate_content_stream(model=MODELO_EXTRACAO, contents=contents, config=config):
+        parciais = []
+        for objeto in parser.feed(chunk.text):
+            try:
+                parciais.append(Transacao.model_validate(objeto).model_dump())
+            except ValidationError:
+                # Objeto parcial inválido: será reportado na validação final
+                continue
+        if parciais:
+            ao_receber_transacoes(parciais)
+
+    return decodificar_extrato(parser.texto)
+
+
+# --- RELATÓRIO CONSOLIDADO ---
+
+def versao_razao(df_transacoes: pd.DataFrame) -> str:
+    """Hash do conteúdo do razão enviado ao modelo (muda quando uma transação é editada, incluída ou removida)."""
+    hashes = pd.util.hash_pandas_object(df_transacoes[COLUNAS_RELATORIO_LLM], index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def montar_prefixo_relatorio(df_transacoes: pd.DataFrame) -> str:
+    """Parte fixa do prompt do relatório: instruções + transações. Serializa só as colunas essenciais,
+    com data 'AAAA-MM-DD', para reduzir o payload de JSON."""
+    df_analise = df_transacoes[COLUNAS_RELATORIO_LLM].assign(data=df_transacoes['data'].dt.strftime('%Y-%m-%d'))
+    transacoes_json = df_analise.to_json(orient='records', date_format='iso', indent=2)
+
+    return (
+        f"Você é um analista financeiro experiente. Analise o seguinte conjunto de transações bancárias em formato JSON: "
+        f"\n\n```json\n{transacoes_json}\n```\n\n"
+        "Com base nessas transações, forneça um relatório conciso e objetivo, com foco na classificação de 'entidade' (EMPRESARIAL ou PESSOAL) e 'categoria_dcf' (OPERACIONAL, INVESTIMENTO, FINANCIAMENTO). "
+        "Destaque os principais pontos de entrada e saída de recursos, e aponte quaisquer anomalias ou observações relevantes sobre o fluxo de caixa da entidade. "
+        "Não inclua o saldo final, pois ele já é uma métrica separada. O relatório deve ser em português do Brasil e ter no máximo 200 palavras."
+    )
+
+
+def montar_sufixo_relatorio(contexto_adicional: str) -> str:
+    """Parte variável do prompt: só o contexto adicional do usuário."""
+    if contexto_adicional:
+        return f"Considere também o seguinte contexto adicional fornecido pelo usuário: {contexto_adicional}"
+    return "Gere o relatório."
+
+
+def _config_relatorio(cached_content=None):
+    return types.GenerateContentConfig(
+        temperature=0.7,  # Temperatura mais alta para criatividade na análise
+        cached_content=cached_content,
+    )
+
+
+def cache_perdido(erro) -> bool:
+    """Erro da API porque o conteúdo em cache não existe mais (expirou pelo TTL ou foi removido).
+
+    A API responde NOT_FOUND ou 'CachedContent not found (or permission denied)' (403); os demais
+    erros de cliente (cota, requisição inválida) não têm relação com o cache.
+    """
+    mensagem = str(erro).lower().replace(' ', '')
+    return getattr(erro, 'code', None) in (400, 403, 404) and 'cachedcontent' in mensagem
+
+
+class ReportCache:
+    """Relatórios consolidados de uma sessão, reaproveitando o payload das transações entre atualizações.
+
+    - o razão é serializado uma única vez por versão (hash do conteúdo);
+    - o prefixo (instruções + transações) vira conteúdo em cache na Gemini API (client.caches) quando
+      tem o tamanho mínimo exigido; a cada atualização só o contexto adicional é enviado, e o prefixo
+      não fica na sessão (é remontado do razão só se o cache remoto se perder);
+    - sem cache explícito (prefixo pequeno, cliente sem 'caches' ou erro), o prefixo é enviado
+      idêntico e antes do contexto, o que aproveita o cache implícito de prefixos do provedor;
+    - os relatórios são memorizados por (versão do razão, contexto).
+    """
+
+    def __init__(self, modelo=MODELO_RELATORIO, ttl=TTL_CACHE_RELATORIO, max_relatorios=MAX_RELATORIOS_MEMORIZADOS):
+        self.modelo = modelo
+        self.ttl = ttl
+        self.max_relatorios = max_relatorios
+        self.versao = None
+        self.estatisticas = {'gerados': 0, 'memorizados': 0, 'com_cache_explicito': 0}
+        self._prefixo = None
+        self._cache_remoto = None
+        self._relatorios = OrderedDict()
+
+    def _preparar(self, df_transacoes, versao, client):
+        self._descartar_cache_remoto(client)
+        self.versao = versao
+        prefixo = montar_prefixo_relatorio(df_transacoes)
+        self._criar_cache_remoto(client, prefixo)
+        # Sem cache remoto o prefixo é reenviado a cada atualização e fica guardado; com ele, não
+        self._prefixo = prefixo if self._cache_remoto is None else None
+
+    def _prefixo_do_razao(self, df_transacoes):
+        return self._prefixo if self._prefixo is not None else montar_prefixo_relatorio(df_transacoes)
+
+    def _criar_cache_remoto(self, client, prefixo):
+        if estimar_tokens(prefixo) < MIN_TOKENS_CACHE_EXPLICITO or not hasattr(client, 'caches'):
+            return
+        try:
+            cache = client.caches.create(model=self.modelo, config=types.CreateCachedContentConfig(
+                contents=[prefixo], ttl=self.ttl, display_name=f"razao-{self.versao[:16]}",
+            ))
+            self._cache_remoto = cache.name
+        except Exception as e:
+            # Sem cache explícito o relatório continua funcionando (com o prefixo enviado inline)
+            print(f"Cache de contexto indisponível para o relatório: {e}")
+
+    def _descartar_cache_remoto(self, client):
+        if self._cache_remoto is None:
+            return
+        try:
+            client.caches.delete(name=self._cache_remoto)
+        except Exception:
+            pass  # Expira sozinho pelo TTL
+        self._cache_remoto = None
+
+    def descartar(self, client):
+        """Esquece o razão atual: remove o cache remoto e os relatórios memorizados (ex: nova análise)."""
+        self._descartar_cache_remoto(client)
+        self.versao = None
+        self._prefixo = None
+        self._relatorios.clear()
+
+    def _gerar(self, df_transacoes, contexto_adicional, client):
+        sufixo = montar_sufixo_relatorio(contexto_adicional)
+        for tentativa in range(2):
+            if self._cache_remoto is None:
+                break
+            try:
+                response = client.models.generate_content(
+                    model=self.modelo, contents=[sufixo], config=_config_relatorio(self._cache_remoto),
+                )
+                self.estatisticas['com_cache_explicito'] += 1
+                return response.text
+            except errors.ClientError as e:
+                if not cache_perdido(e):
+                    raise
+                # Cache expirado (TTL) ou removido: recria uma vez e, se falhar de novo, segue sem ele
+                print(f"Cache de contexto do relatório perdido: {e}")
+                self._cache_remoto = None
+                if tentativa == 0:
+                    self._criar_cache_remoto(client, self._prefixo_do_razao(df_transacoes))
+        # Sem cache remoto daqui em diante: o prefixo passa a ser guardado e enviado inline
+        self._prefixo = self._prefixo_do_razao(df_transacoes)
+        response = client.models.generate_content(
+            model=self.modelo, contents=[self._prefixo, sufixo], config=_config_relatorio(),
+        )
+        return response.text
+
+    def gerar(self, df_transacoes: pd.DataFrame, contexto_adicional: str, client) -> str:
+        """Relatório para o razão e o contexto dados (erros da API são propagados e não memorizados)."""
+        versao = versao_razao(df_transacoes)
+        chave = (versao, (contexto_adicional or '').strip())
+        if chave in self._relatorios:
+            self._relatorios.move_to_end(chave)
+            self.estatisticas['memorizados'] += 1
+            return self._relatorios[chave]
+
+        if versao != self.versao:
+            self._preparar(df_transacoes, versao, client)
+        relatorio = self._gerar(df_transacoes, chave[1], client)
+        self.estatisticas['gerados'] += 1
+
+        self._relatorios[chave] = relatorio
+        if len(self._relatorios) > self.max_relatorios:
+            self._relatorios.popitem(last=False)
+        return relatorio
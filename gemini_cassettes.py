@@ -0,0 +1,327 @@
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+
+from google.genai import errors, types
+
+from gemini_scheduler import CHARS_POR_TOKEN, estimar_tokens
+
+# Tamanho dos pedaços (em caracteres) quando uma resposta gravada sem streaming é reproduzida em streaming
+CHARS_POR_PEDACO = 400
+
+# Campos da resposta que não são gravados (cabeçalhos HTTP e objeto já convertido pelo SDK)
+_CAMPOS_NAO_GRAVADOS = {'sdk_http_response', 'parsed'}
+
+
+def _serializavel(objeto):
+    if isinstance(objeto, type) and hasattr(objeto, 'model_json_schema'):
+        # response_schema é a classe pydantic: o que importa para a requisição é o JSON schema
+        return objeto.model_json_schema()
+    if hasattr(objeto, 'model_fields'):
+        return {campo: valor for campo, valor in objeto if valor is not None}
+    if isinstance(objeto, bytes):
+        return hashlib.sha256(objeto).hexdigest()
+    return str(objeto)
+
+
+def chave_requisicao(model, contents, config=None):
+    """Identificador estável de uma requisição (modelo + conteúdo + configuração)."""
+    texto = json.dumps([model, contents, config], default=_serializavel, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def erro_cache_inexistente(nome):
+    """Mesmo erro que a API retorna para um conteúdo em cache expirado ou removido."""
+    return errors.ClientError(403, {'error': {
+        'code': 403, 'message': f'CachedContent not found (or permission denied): {nome}', 'status': 'PERMISSION_DENIED',
+    }})
+
+
+class _CachesConhecidos:
+    """Conteúdos em cache criados pelo cliente (nome -> contents).
+
+    Uma chamada com config.cached_content é gravada e reproduzida pela mesma chave da chamada com o
+    conteúdo do cache enviado inline antes do prompt: o cassete não depende dos nomes gerados pela API.
+    """
+
+    def __init__(self):
+        self._conteudos = {}
+        self._lock = threading.Lock()
+
+    def adicionar(self, nome, contents):
+        with self._lock:
+            self._conteudos[nome] = list(contents or [])
+
+    def __contains__(self, nome):
+        with self._lock:
+            return nome in self._conteudos
+
+    def remover(self, nome):
+        with self._lock:
+            self._conteudos.pop(nome, None)
+
+    def expandir(self, contents, config):
+        """(contents, config) equivalentes sem cached_content; KeyError se o cache não é conhecido."""
+        nome = getattr(config, 'cached_content', None)
+        if not nome:
+            return contents, config
+        with self._lock:
+            prefixo = self._conteudos[nome]
+        contents = contents if isinstance(contents, list) else [contents]
+        return prefixo + contents, config.model_copy(update={'cached_content': None})
+
+
+def _gravar_resposta(resposta):
+    return resposta.model_dump(mode='json', exclude_none=True, exclude=_CAMPOS_NAO_GRAVADOS)
+
+
+def resposta_simulada(texto, tokens_entrada, tokens_saida=None):
+    """GenerateContentResponse com o texto dado (tokens de saída estimados pelo tamanho do texto se omitidos)."""
+    if tokens_saida is None:
+        tokens_saida = len(texto) // CHARS_POR_TOKEN + 1
+    return types.GenerateContentResponse.model_validate({
+        'candidates': [{'content': {'parts': [{'text': texto}], 'role': 'model'}, 'finish_reason': 'STOP'}],
+        'usage_metadata': {
+            'prompt_token_count': tokens_entrada,
+            'candidates_token_count': tokens_saida,
+            'total_token_count': tokens_entrada + tokens_saida,
+        },
+    })
+
+
+def erro_503():
+    """Mesmo erro que o SDK levanta quando o modelo está sobrecarregado."""
+    return errors.ServerError(503, {'error': {
+        'code': 503, 'message': 'The model is overloaded. Please try again later.', 'status': 'UNAVAILABLE',
+    }})
+
+
+def carregar_cassete(caminho):
+    """Lê um cassete (JSONL) em {chave: [gravações na ordem em que ocorreram]}."""
+    gravacoes = {}
+    with open(caminho, encoding='utf-8') as arquivo:
+        for linha in arquivo:
+            if linha.strip():
+                registro = json.loads(linha)
+                gravacoes.setdefault(registro['chave'], []).append(registro)
+    return gravacoes
+
+
+class _RecordingCaches:
+    def __init__(self, gravador):
+        self._gravador = gravador
+
+    def create(self, *, model, config=None):
+        cache = self._gravador.client.caches.create(model=model, config=config)
+        self._gravador.caches_conhecidos.adicionar(cache.name, getattr(config, 'contents', None))
+        return cache
+
+    def delete(self, *, name, config=None):
+        self._gravador.caches_conhecidos.remover(name)
+        return self._gravador.client.caches.delete(name=name, config=config)
+
+    def __getattr__(self, nome):
+        return getattr(self._gravador.client.caches, nome)
+
+
+class _RecordingModels:
+    def __init__(self, gravador):
+        self._gravador = gravador
+
+    def generate_content(self, *, model, contents, config=None):
+        inicio = time.monotonic()
+        resposta = self._gravador.client.models.generate_content(model=model, contents=contents, config=config)
+        self._gravador.gravar(model, contents, config, [resposta], time.monotonic() - inicio, stream=False)
+        return resposta
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        inicio = time.monotonic()
+        pedacos = []
+        for pedaco in self._gravador.client.models.generate_content_stream(model=model, contents=contents, config=config):
+            pedacos.append(pedaco)
+            yield pedaco
+        # Só respostas completas são gravadas (um stream interrompido não vira cassete)
+        self._gravador.gravar(model, contents, config, pedacos, time.monotonic() - inicio, stream=True)
+
+
+class RecordingClient:
+    """Fachada de genai.Client que repassa as chamadas ao cliente real e grava requisição/resposta
+    em um cassete JSONL (uma linha por chamada), para reprodução offline com ReplayClient.
+
+    Chamadas que usam um cache criado por 'caches' são gravadas com o conteúdo do cache inline."""
+
+    def __init__(self, client, caminho):
+        self.client = client
+        self.caminho = caminho
+        self.models = _RecordingModels(self)
+        self.caches = _RecordingCaches(self)
+        self.caches_conhecidos = _CachesConhecidos()
+        self._lock = threading.Lock()
+
+    def gravar(self, model, contents, config, respostas, latencia, stream):
+        try:
+            contents, config = self.caches_conhecidos.expandir(contents, config)
+        except KeyError:
+            pass  # Cache criado fora deste cliente: a chamada é gravada como foi feita
+        registro = {
+            'chave': chave_requisicao(model, contents, config),
+            'modelo': model,
+            'stream': stream,
+            'latencia': round(latencia, 4),
+            'respostas': [_gravar_resposta(resposta) for resposta in respostas],
+        }
+        linha = json.dumps(registro, ensure_ascii=False) + '\n'
+        with self._lock, open(self.caminho, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(linha)
+
+    def __getattr__(self, nome):
+        return getattr(self.client, nome)
+
+
+class _ReplayCaches:
+    def __init__(self, replay):
+        self._replay = replay
+        self._numeros = itertools.count(1)
+
+    def create(self, *, model, config=None):
+        contents = getattr(config, 'contents', None) or []
+        nome = f"cachedContents/replay-{next(self._numeros)}"
+        self._replay.caches_conhecidos.adicionar(nome, contents)
+        return types.CachedContent(
+            name=nome, model=model, display_name=getattr(config, 'display_name', None),
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=self._replay.uso(contents, '')[0]),
+        )
+
+    def get(self, *, name, config=None):
+        if name not in self._replay.caches_conhecidos:
+            raise erro_cache_inexistente(name)
+        return types.CachedContent(name=name)
+
+    def delete(self, *, name, config=None):
+        self._replay.caches_conhecidos.remover(name)
+
+
+class _ReplayModels:
+    def __init__(self, replay):
+        self._replay = replay
+
+    def generate_content(self, *, model, contents, config=None):
+        respostas, latencia = self._replay.responder(model, contents, config)
+        self._replay.esperar(latencia)
+        if len(respostas) == 1:
+            return respostas[0]
+        # Gravação feita em streaming: o texto completo é a concatenação dos pedaços (o uso vem no último)
+        texto = ''.join(resposta.text or '' for resposta in respostas)
+        return resposta_simulada(texto, *self._replay.uso(contents, texto, respostas[-1]))
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        respostas, latencia = self._replay.responder(model, contents, config)
+        if len(respostas) == 1:
+            texto = respostas[0].text or ''
+            partes = [texto[i:i + CHARS_POR_PEDACO] for i in range(0, len(texto), CHARS_POR_PEDACO)] or ['']
+            # Como na API, o último pedaço traz o uso acumulado da resposta inteira
+            respostas = [resposta_simulada(parte, 0) for parte in partes[:-1]] + \
+                [resposta_simulada(partes[-1], *self._replay.uso(contents, texto, respostas[0]))]
+        # A latência se divide entre o primeiro pedaço e o restante da geração
+        self._replay.esperar(latencia / 2)
+        intervalo = latencia / 2 / len(respostas)
+        for resposta in respostas:
+            yield resposta
+            self._replay.esperar(intervalo)
+
+
+class ReplayClient:
+    """Fachada de genai.Client sem rede: reproduz respostas de um cassete e/ou as simula.
+
+    - latencia: segundos por chamada (None usa a latência gravada no cassete);
+    - jitter: variação relativa da latência (0.3 = ±30%);
+    - taxa_503: probabilidade de cada chamada falhar com 503 UNAVAILABLE (o mesmo erro do SDK);
+    - escala_tempo: multiplica todas as esperas (ex: 0.1 roda o benchmark 10x mais rápido);
+    - tokens_entrada / tokens_saida: contagens informadas em usage_metadata de cada resposta, que o
+      scheduler usa para corrigir o TPM (None usa as gravadas no cassete, ou estima pelo tamanho do texto);
+    - gerar_resposta(model, contents, config) -> str: texto para requisições que não estão no
+      cassete (sem ela, uma requisição desconhecida levanta KeyError).
+
+    'caches' simula o cache de contexto: chamadas com cached_content são reproduzidas pela gravação
+    da chamada equivalente com o conteúdo inline, e um cache desconhecido dá o erro da API.
+    """
+
+    def __init__(self, caminho=None, latencia=None, jitter=0.0, taxa_503=0.0, escala_tempo=1.0,
+                 gerar_resposta=None, semente=None, tokens_entrada=None, tokens_saida=None):
+        self.gravacoes = carregar_cassete(caminho) if caminho else {}
+        self.latencia = latencia
+        self.jitter = jitter
+        self.taxa_503 = taxa_503
+        self.escala_tempo = escala_tempo
+        self.gerar_resposta = gerar_resposta
+        self.tokens_entrada = tokens_entrada
+        self.tokens_saida = tokens_saida
+        self.models = _ReplayModels(self)
+        self.caches = _ReplayCaches(self)
+        self.caches_conhecidos = _CachesConhecidos()
+        self.estatisticas = {'chamadas': 0, 'do_cassete': 0, 'simuladas': 0, 'erros_503': 0}
+        self._aleatorio = random.Random(semente)
+        self._lock = threading.Lock()
+        # Chamadas repetidas da mesma requisição percorrem as gravações em ordem (e recomeçam no fim)
+        self._proxima = {chave: itertools.cycle(registros) for chave, registros in self.gravacoes.items()}
+
+    def esperar(self, segundos):
+        if segundos > 0:
+            time.sleep(segundos * self.escala_tempo)
+
+    def uso(self, contents, texto, gravada=None):
+        """(tokens de entrada, tokens de saída) de uma resposta: os configurados, senão os gravados,
+        senão estimados."""
+        metadados = getattr(gravada, 'usage_metadata', None)
+        entrada = self.tokens_entrada
+        if entrada is None:
+            entrada = getattr(metadados, 'prompt_token_count', None) or estimar_tokens(contents)
+        saida = self.tokens_saida
+        if saida is None:
+            saida = getattr(metadados, 'candidates_token_count', None) or len(texto) // CHARS_POR_TOKEN + 1
+        return entrada, saida
+
+    def _latencia(self, gravada):
+        base = gravada if self.latencia is None else self.latencia
+        with self._lock:
+            return max(0.0, base * (1 + self._aleatorio.uniform(-self.jitter, self.jitter)))
+
+    def responder(self, model, contents, config):
+        """Retorna (respostas, latência) da requisição ou levanta o 503 simulado."""
+        try:
+            contents, config = self.caches_conhecidos.expandir(contents, config)
+        except KeyError:
+            raise erro_cache_inexistente(config.cached_content) from None
+        chave = chave_requisicao(model, contents, config)
+        with self._lock:
+            self.estatisticas['chamadas'] += 1
+            falhar = self._aleatorio.random() < self.taxa_503
+            # A retentativa de uma chamada que falhou recebe a mesma gravação
+            registro = next(self._proxima[chave]) if chave in self._proxima and not falhar else None
+            if falhar:
+                self.estatisticas['erros_503'] += 1
+            elif registro is not None:
+                self.estatisticas['do_cassete'] += 1
+            elif self.gerar_resposta is not None:
+                self.estatisticas['simuladas'] += 1
+
+        if falhar:
+            # A sobrecarga costuma ser reportada rápido, antes de qualquer geração
+            self.esperar(self._latencia(0.0) / 10)
+            raise erro_503()
+        if registro is not None:
+            respostas = [types.GenerateContentResponse.model_validate(r) for r in registro['respostas']]
+            if self.tokens_entrada is not None or self.tokens_saida is not None:
+                texto = ''.join(resposta.text or '' for resposta in respostas)
+                entrada, saida = self.uso(contents, texto, respostas[-1])
+                respostas[-1].usage_metadata = types.GenerateContentResponseUsageMetadata(
+                    prompt_token_count=entrada, candidates_token_count=saida, total_token_count=entrada + saida,
+                )
+            return respostas, self._latencia(registro['latencia'])
+        if self.gerar_resposta is None:
+            raise KeyError(f"Requisição não encontrada no cassete (modelo {model}, chave {chave[:12]}).")
+        texto = self.gerar_resposta(model, contents, config)
+        return [resposta_simulada(texto, *self.uso(contents, texto))], self._latencia(0.0)
@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+# Prioridades (menor = atendida primeiro)
+PRIORIDADE_INTERATIVA = 0   # atualizações de relatório disparadas pelo usuário
+PRIORIDADE_LOTE = 10        # extração e classificação em massa
+
+# Limites padrão do processo inteiro (todas as sessões somadas)
+LIMITE_RPM_PADRAO = 60
+LIMITE_TPM_PADRAO = 250_000
+WORKERS_PADRAO = 4
+
+# Retentativas para sobrecarga/limite da API (503, 429, 500)
+CODIGOS_RETENTATIVA = (429, 500, 503)
+MAX_RETENTATIVAS = 4
+ESPERA_BASE_RETENTATIVA = 2.0
+ESPERA_MAX_RETENTATIVA = 60.0
+
+CHARS_POR_TOKEN = 4
+
+
+def estimar_tokens(contents):
+    """Estimativa grosseira de tokens de entrada (~4 caracteres por token)."""
+    if isinstance(contents, str):
+        return len(contents) // CHARS_POR_TOKEN + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimar_tokens(parte) for parte in contents)
+    return 1
+
+
+def _tokens_usados(resposta):
+    return getattr(getattr(resposta, 'usage_metadata', None), 'total_token_count', None)
+
+
+def _deve_repetir(erro):
+    codigo = getattr(erro, 'code', None)
+    if codigo in CODIGOS_RETENTATIVA:
+        return True
+    mensagem = str(erro)
+    return "503 UNAVAILABLE" in mensagem or "model is overloaded" in mensagem or "RESOURCE_EXHAUSTED" in mensagem
+
+
+class TokenBucket:
+    """Balde de tokens reabastecido continuamente até 'capacidade_por_minuto'."""
+
+    def __init__(self, capacidade_por_minuto):
+        self.capacidade = float(capacidade_por_minuto)
+        self.disponivel = self.capacidade
+        self._taxa = self.capacidade / 60.0
+        self._ultimo = time.monotonic()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.disponivel = min(self.capacidade, self.disponivel + (agora - self._ultimo) * self._taxa)
+        self._ultimo = agora
+
+    def tempo_ate(self, quantidade):
+        """Segundos até haver 'quantidade' disponível (0 se já houver)."""
+        self._repor()
+        falta = min(quantidade, self.capacidade) - self.disponivel
+        return max(0.0, falta / self._taxa)
+
+    def consumir(self, quantidade):
+        self._repor()
+        self.disponivel -= min(quantidade, self.capacidade)
+
+    def ajustar(self, diferenca):
+        """Corrige o consumo estimado pelo consumo real informado pela API."""
+        self._repor()
+        self.disponivel = min(self.capacidade, self.disponivel - diferenca)
+
+
+class _Requisicao:
+    __slots__ = ('funcao', 'sessao', 'prioridade', 'tokens', 'inicio_virtual', 'fim_virtual', 'futuro', 'tentativas')
+
+    def __init__(self, funcao, sessao, prioridade, tokens, inicio_virtual, fim_virtual):
+        self.funcao = funcao
+        self.sessao = sessao
+        self.prioridade = prioridade
+        self.tokens = tokens
+        self.inicio_virtual = inicio_virtual
+        self.fim_virtual = fim_virtual
+        self.futuro = Future()
+        self.tentativas = 0
+
+
+class GeminiScheduler:
+    """Fila única do processo para chamadas à Gemini API.
+
+    - um único genai.Client (conexões keep-alive reaproveitadas por todas as sessões);
+    - limites de requisições e de tokens por minuto (token bucket);
+    - fila de prioridade (interativo antes de lote);
+    - dentro da mesma prioridade, divisão justa entre sessões (fair queuing por tempo virtual);
+    - em 503/429, uma pausa global com jitter em vez de retentativas simultâneas de cada sessão.
+    """
+
+    def __init__(self, client, rpm=LIMITE_RPM_PADRAO, tpm=LIMITE_TPM_PADRAO, workers=WORKERS_PADRAO,
+                 espera_base=ESPERA_BASE_RETENTATIVA):
+        self.client = client
+        self._espera_base = espera_base
+        self._requisicoes = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._fila = []
+        self._sequencia = itertools.count()
+        self._cond = threading.Condition()
+        self._tempo_virtual = 0.0
+        self._fim_por_sessao = {}
+        self._pausa_ate = 0.0
+        self.estatisticas = {'enviadas': 0, 'retentativas': 0, 'falhas': 0}
+        for i in range(workers):
+            threading.Thread(target=self._loop, name=f"gemini-scheduler-{i}", daemon=True).start()
+
+    def submit(self, funcao, sessao, prioridade=PRIORIDADE_LOTE, tokens=1):
+        """Enfileira 'funcao(client)' e retorna um Future com o resultado."""
+        with self._cond:
+            inicio = max(self._tempo_virtual, self._fim_por_sessao.get(sessao, 0.0))
+            fim = inicio + max(1, tokens)
+            self._fim_por_sessao[sessao] = fim
+            requisicao = _Requisicao(funcao, sessao, prioridade, tokens, inicio, fim)
+            self._enfileirar(requisicao)
+        return requisicao.futuro
+
+    def _enfileirar(self, requisicao):
+        heapq.heappush(self._fila, (requisicao.prioridade, requisicao.fim_virtual, next(self._sequencia), requisicao))
+        self._cond.notify()
+
+    def _proxima(self):
+        with self._cond:
+            while True:
+                if not self._fila:
+                    self._cond.wait()
+                    continue
+                requisicao = self._fila[0][-1]
+                espera = max(
+                    self._pausa_ate - time.monotonic(),
+                    self._requisicoes.tempo_ate(1),
+                    self._tokens.tempo_ate(requisicao.tokens),
+                )
+                if espera > 0:
+                    # Reavalia ao acordar: uma requisição mais prioritária pode ter chegado
+                    self._cond.wait(espera)
+                    continue
+                heapq.heappop(self._fila)
+                self._requisicoes.consumir(1)
+                self._tokens.consumir(requisicao.tokens)
+                self._tempo_virtual = max(self._tempo_virtual, requisicao.inicio_virtual)
+                self._fim_por_sessao = {s: f for s, f in self._fim_por_sessao.items() if f > self._tempo_virtual}
+                self.estatisticas['enviadas'] += 1
+                return requisicao
+
+    def _loop(self):
+        while True:
+            requisicao = self._proxima()
+            try:
+                resultado = requisicao.funcao(self.client)
+            except Exception as e:
+                self._tratar_erro(requisicao, e)
+                continue
+            self.ajustar_uso(requisicao.tokens, _tokens_usados(resultado))
+            requisicao.futuro.set_result(resultado)
+
+    def ajustar_uso(self, estimado, uso):
+        """Corrige o balde de tokens com o uso real informado pela API (se houver)."""
+        if uso:
+            with self._cond:
+                self._tokens.ajustar(uso - estimado)
+
+    def _pausar(self, tentativas):
+        # A pausa vale para o processo inteiro: as sessões não retentam todas ao mesmo tempo
+        espera = min(ESPERA_MAX_RETENTATIVA, self._espera_base * 2 ** tentativas)
+        espera *= random.uniform(0.5, 1.0)
+        self._pausa_ate = max(self._pausa_ate, time.monotonic() + espera)
+
+    def _tratar_erro(self, requisicao, erro):
+        if _deve_repetir(erro) and requisicao.tentativas < MAX_RETENTATIVAS:
+            requisicao.tentativas += 1
+            with self._cond:
+                self._pausar(requisicao.tentativas)
+                self.estatisticas['retentativas'] += 1
+                self._enfileirar(requisicao)
+            return
+        with self._cond:
+            self.estatisticas['falhas'] += 1
+        requisicao.futuro.set_exception(erro)
+
+    def acompanhar_stream(self, pedacos, tokens_estimados):
+        """Repassa os pedaços de um stream iniciado pelo scheduler e, no fim, corrige o TPM com o uso real.
+
+        Só o primeiro pedaço passa pela fila (e pelas retentativas). Um erro no meio do stream não é
+        retentado, porque os pedaços anteriores já foram entregues ao chamador: ele é propagado e,
+        se for sobrecarga (503/429), pausa o processo como uma retentativa.
+        """
+        uso = None
+        try:
+            for pedaco in pedacos:
+                # O uso acumulado chega no último pedaço
+                uso = _tokens_usados(pedaco) or uso
+                yield pedaco
+        except Exception as e:
+            with self._cond:
+                if _deve_repetir(e):
+                    self._pausar(1)
+                self.estatisticas['falhas'] += 1
+            raise
+        self.ajustar_uso(tokens_estimados, uso)
+
+    def client_for(self, sessao, prioridade=PRIORIDADE_LOTE):
+        """Cliente com a mesma interface de genai.Client cujas chamadas passam pelo scheduler."""
+        return ScheduledClient(self, sessao, prioridade)
+
+
+class _ScheduledApi:
+    def __init__(self, scheduler, sessao, prioridade):
+        self._scheduler = scheduler
+        self._sessao = sessao
+        self._prioridade = prioridade
+
+    def _executar(self, funcao, tokens=1):
+        return self._scheduler.submit(funcao, self._sessao, self._prioridade, tokens).result()
+
+
+class _ScheduledModels(_ScheduledApi):
+    def generate_content(self, *, model, contents, config=None):
+        return self._executar(
+            lambda client: client.models.generate_content(model=model, contents=contents, config=config),
+            estimar_tokens(contents),
+        )
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        def iniciar(client):
+            # O primeiro pedaço é lido dentro do scheduler para que erros de capacidade sejam retentados
+            pedacos = client.models.generate_content_stream(model=model, contents=contents, config=config)
+            primeiro = next(pedacos, None)
+            return itertools.chain([] if primeiro is None else [primeiro], pedacos)
+
+        tokens = estimar_tokens(contents)
+        futuro = self._scheduler.submit(iniciar, self._sessao, self._prioridade, tokens)
+        return self._scheduler.acompanhar_stream(futuro.result(), tokens)
+
+
+class _ScheduledCaches(_ScheduledApi):
+    def create(self, *, model, config=None):
+        # Criar o cache processa o conteúdo inteiro: conta no TPM como uma requisição com esse prompt
+        return self._executar(
+            lambda client: client.caches.create(model=model, config=config),
+            estimar_tokens(getattr(config, 'contents', None) or ''),
+        )
+
+    def get(self, *, name, config=None):
+        return self._executar(lambda client: client.caches.get(name=name, config=config))
+
+    def delete(self, *, name, config=None):
+        return self._executar(lambda client: client.caches.delete(name=name, config=config))
+
+
+class ScheduledClient:
+    """Fachada de genai.Client: 'models' e 'caches' passam pelo scheduler; o restante é delegado ao
+    cliente real."""
+
+    def __init__(self, scheduler, sessao, prioridade):
+        self.models = _ScheduledModels(scheduler, sessao, prioridade)
+        if hasattr(scheduler.client, 'caches'):
+            self.caches = _ScheduledCaches(scheduler, sessao, prioridade)
+        self._client = scheduler.client
+
+    def __getattr__(self, nome):
+        return getattr(self._client, nome)
@@ -1,9 +1,109 @@
-
 import pandas as pd
 
-def generate_cash_flow_report(df_classified):
-    # Agrupar por Categoria e somar os valores
-    report = df_classified.groupby('Categoria')['Valor'].sum().reset_index()
+# Granularidades suportadas pelo cubo: alias de período do pandas -> nome da coluna de tempo
+GRANULARIDADES = {
+    'D': 'Dia',
+    'W': 'Semana',
+    'M': 'AnoMes',
+    'Q': 'Trimestre',
+    'Y': 'Ano',
+}
+
+# Dimensões que o cubo agrega quando estão presentes no DataFrame classificado
+DIMENSOES_CUBO = ('Categoria', 'DCF', 'Entidade')
+
+
+class CashFlowCube:
+    """Cubo de fluxo de caixa agregado por dia e dimensão, com roll-ups sob demanda."""
+
+    def __init__(self, base, dimensoes):
+        # base: uma linha por (Dia, *dimensoes) com 'Valor' e 'Transacoes'
+        self.base = base
+        self.dimensoes = tuple(dimensoes)
+        self._rollups = {}
+
+    def _validar(self, freq, por):
+        if freq not in GRANULARIDADES:
+            raise ValueError(f"Granularidade '{freq}' inválida. Use uma de {list(GRANULARIDADES)}.")
+        desconhecidas = [d for d in por if d not in self.dimensoes]
+        if desconhecidas:
+            raise ValueError(f"Dimensões {desconhecidas} não existem no cubo. Disponíveis: {list(self.dimensoes)}.")
+
+    def rollup(self, freq='M', por=(), filtros=None):
+        """Retorna o total por período (e dimensões em 'por'), lendo apenas o cubo diário."""
+        por = tuple(por)
+        self._validar(freq, por)
+        filtros = filtros or {}
+        self._validar(freq, tuple(filtros))
+
+        chave = (freq, por, tuple(sorted((k, v if isinstance(v, str) else tuple(v)) for k, v in filtros.items())))
+        if chave in self._rollups:
+            return self._rollups[chave]
+
+        base = self.base
+        for dimensao, valor in filtros.items():
+            valores = [valor] if isinstance(valor, str) else list(valor)
+            base = base[base[dimensao].isin(valores)]
+
+        coluna_tempo = GRANULARIDADES[freq]
+        periodo = base['Dia'] if freq == 'D' else base['Dia'].dt.to_period(freq)
+        resultado = (
+            base.groupby([periodo.rename(coluna_tempo), *por], observed=True, dropna=False)[['Valor', 'Transacoes']]
+            .sum()
+            .sort_index()
+        )
+        self._rollups[chave] = resultado
+        return resultado
+
+    def pivot(self, freq='M', coluna='Categoria', filtros=None):
+        """Tabela período x dimensão, com a coluna 'Total' no final (como o relatório mensal)."""
+        tabela = self.rollup(freq, (coluna,), filtros)['Valor'].unstack(fill_value=0)
+        tabela['Total'] = tabela.sum(axis=1)
+        return tabela
+
+    def saldo_acumulado(self, freq='M', por=(), filtros=None, saldo_inicial=0.0):
+        """Fluxo por período e saldo acumulado (running balance), opcionalmente por dimensão."""
+        por = tuple(por)
+        fluxo = self.rollup(freq, por, filtros)['Valor']
+        if por:
+            fluxo = fluxo.unstack(list(por), fill_value=0)
+            saldo = fluxo.cumsum() + saldo_inicial
+            return pd.concat({'Fluxo': fluxo, 'Saldo Acumulado': saldo}, axis=1)
+        return pd.DataFrame({'Fluxo': fluxo, 'Saldo Acumulado': fluxo.cumsum() + saldo_inicial})
+
+    def totais(self, por=(), filtros=None):
+        """Totais do período inteiro por dimensão (sem recorte de tempo)."""
+        anual = self.rollup('Y', por, filtros)
+        if not por:
+            return anual.sum()
+        return anual.groupby(level=list(por), observed=True, dropna=False).sum()
+
+    def total(self, filtros=None):
+        """Soma de todos os valores do cubo (após filtros)."""
+        return self.totais((), filtros)['Valor']
+
+
+def build_cash_flow_cube(df_classified, date_col='Data', value_col='Valor', dimensoes=DIMENSOES_CUBO):
+    """Monta o cubo em uma única passada sobre as transações (agregação no nível diário)."""
+    dimensoes = [d for d in dimensoes if d in df_classified.columns]
+    dia = pd.to_datetime(df_classified[date_col]).dt.normalize().rename('Dia')
+    chaves = [dia] + [df_classified[d].fillna('Não Classificado') for d in dimensoes]
+
+    base = (
+        df_classified[value_col]
+        .groupby(chaves, sort=True, dropna=False)
+        .agg(['sum', 'size'])
+        .rename(columns={'sum': 'Valor', 'size': 'Transacoes'})
+        .reset_index()
+    )
+    return CashFlowCube(base, dimensoes)
+
+
+def generate_cash_flow_report(df_classified, cube=None):
+    cube = cube if cube is not None else build_cash_flow_cube(df_classified)
+
+    # Totais por Categoria lidos do cubo (sem reagrupar as transações)
+    report = cube.totais(('Categoria',))['Valor'].reset_index()
     report.rename(columns={'Valor': 'Total'}, inplace=True)
 
     # Separar receitas e despesas
@@ -11,14 +111,15 @@ def generate_cash_flow_report(df_classified):
     despesas = report[report['Total'] <= 0].sort_values(by='Total')
 
     # Calcular o saldo total
-    saldo_total = df_classified['Valor'].sum()
+    saldo_total = cube.total()
 
     return receitas, despesas, saldo_total
 
-def generate_monthly_cash_flow(df_classified):
-    df_classified['AnoMes'] = df_classified['Data'].dt.to_period('M')
-    monthly_summary = df_classified.groupby(['AnoMes', 'Categoria'])['Valor'].sum().unstack(fill_value=0)
-    monthly_summary['Total Mensal'] = monthly_summary.sum(axis=1)
+def generate_monthly_cash_flow(df_classified, cube=None):
+    # Não altera o DataFrame recebido: o período é derivado dentro do cubo
+    cube = cube if cube is not None else build_cash_flow_cube(df_classified)
+    monthly_summary = cube.pivot('M', 'Categoria').rename(columns={'Total': 'Total Mensal'})
+    monthly_summary.columns.name = 'Categoria'
     return monthly_summary
 
 
@@ -65,3 +166,8 @@ if __name__ == "__main__":
     monthly_report = generate_monthly_cash_flow(df_test_classified)
     print(monthly_report.to_markdown())
 
+    print("\n--- Cubo de Fluxo de Caixa (Trimestral, com Saldo Acumulado) ---")
+    cube = build_cash_flow_cube(df_test_classified)
+    print(cube.saldo_acumulado('Q').to_markdown())
+    print(cube.pivot('W', 'Categoria', filtros={'Categoria': ['Receita', 'Moradia']}).to_markdown())
+
@@ -0,0 +1,229 @@
+import codecs
+import csv
+import io
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from brl_codec import MAX_EXEMPLOS_ERRO, parse_brl
+from classify_transactions import classify_descriptions, normalize_description, normalize_descriptions
+from ingest_transactions import converter_datas
+
+FORMATOS_IMPORTACAO = ('.ofx', '.csv')
+
+# Linhas por bloco na leitura de CSV e transações por bloco na leitura de OFX
+CHUNK_ROWS = 50_000
+TAMANHO_LEITURA = 256 * 1024
+
+# Campos de uma transação OFX (<STMTTRN>) utilizados
+_CAMPOS_OFX = {'TRNTYPE', 'DTPOSTED', 'TRNAMT', 'FITID', 'MEMO', 'NAME', 'CHECKNUM'}
+_PADRAO_TAG_OFX = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+_PADRAO_DATA_OFX = re.compile(r'^(\d{8})')
+
+# Linhas de saldo que alguns bancos incluem no CSV ('Saldo Anterior', 'SALDO DO DIA', 'S A L D O'): não são
+# transações. Comparadas com a descrição normalizada (sem datas/números) e sem espaços
+_PADRAO_LINHA_SALDO = re.compile(
+    r'^(saldo|sdo)(anterior|ant|dodia|dia|final|inicial|atual|parcial|total|disponivel|totaldisponiveldia|emconta)?$'
+)
+
+# Nomes de colunas aceitos nos CSVs exportados pelos bancos (já normalizados, sem acentos)
+ALIASES_CSV = {
+    'data': ('data', 'data lancamento', 'data de lancamento', 'data mov', 'data movimento', 'dt lancamento', 'date'),
+    'descricao': ('historico', 'descricao', 'lancamento', 'lancamentos', 'memo', 'detalhamento', 'description'),
+    'valor': ('valor', 'valor r', 'valor rs', 'value', 'amount'),
+    'tipo': ('tipo', 'c d', 'd c', 'natureza', 'deb cred'),
+    'credito': ('credito', 'entrada', 'entradas'),
+    'debito': ('debito', 'saida', 'saidas'),
+}
+
+
+def _detectar_codificacao_ofx(cabecalho):
+    texto = cabecalho.decode('ascii', errors='ignore').upper()
+    xml = re.search(r'ENCODING="([^"]+)"', texto)
+    if xml:
+        return xml.group(1).lower()
+    if 'CHARSET:1252' in texto or 'ENCODING:USASCII' in texto:
+        return 'cp1252'
+    return 'utf-8'
+
+
+def _parse_valor_ofx(texto):
+    texto = texto.strip().replace(' ', '')
+    # Alguns bancos brasileiros emitem TRNAMT com vírgula decimal
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto)
+
+
+def _transacao_ofx(campos):
+    data = _PADRAO_DATA_OFX.match(campos.get('DTPOSTED', '').strip())
+    descricao = (campos.get('MEMO') or campos.get('NAME') or '').strip()
+    return {
+        'data': pd.Timestamp(data.group(1)) if data else pd.NaT,
+        'descricao': descricao,
+        'valor': _parse_valor_ofx(campos.get('TRNAMT', '0')),
+        'fitid': campos.get('FITID', '').strip(),
+    }
+
+
+def iter_ofx_transactions(arquivo):
+    """Lê um OFX (SGML 1.x ou XML 2.x) em blocos, gerando uma transação por <STMTTRN>."""
+    # O cabeçalho (SGML ou declaração XML) define a codificação do restante do arquivo
+    inicio = arquivo.read(max(TAMANHO_LEITURA, 4096))
+    decodificador = codecs.getincrementaldecoder(_detectar_codificacao_ofx(inicio[:4096]))(errors='replace')
+
+    buffer = ''
+    campos = None
+    bloco = inicio
+    while True:
+        final = not bloco
+        buffer += decodificador.decode(bloco, final=final)
+        # Processa até a última tag completa; o restante espera o próximo bloco
+        limite = len(buffer) if final else buffer.rfind('<')
+        if limite > 0:
+            for fechamento, tag, valor in _PADRAO_TAG_OFX.findall(buffer[:limite]):
+                tag = tag.upper()
+                if tag == 'STMTTRN':
+                    if campos is not None:
+                        yield _transacao_ofx(campos)
+                    campos = None if fechamento else {}
+                elif campos is not None and not fechamento and tag in _CAMPOS_OFX:
+                    campos[tag] = valor
+                elif tag == 'BANKTRANLIST' and fechamento and campos is not None:
+                    yield _transacao_ofx(campos)
+                    campos = None
+            buffer = buffer[limite:]
+        if final:
+            break
+        bloco = arquivo.read(TAMANHO_LEITURA)
+
+    if campos is not None:
+        yield _transacao_ofx(campos)
+
+
+def iter_ofx_chunks(arquivo, chunk_rows=CHUNK_ROWS):
+    """Agrupa as transações do OFX em DataFrames (data, descricao, valor com sinal)."""
+    lote = []
+    for transacao in iter_ofx_transactions(arquivo):
+        lote.append(transacao)
+        if len(lote) >= chunk_rows:
+            yield pd.DataFrame(lote)
+            lote = []
+    if lote:
+        yield pd.DataFrame(lote)
+
+
+def _mapear_colunas_csv(colunas):
+    normalizadas = {normalize_description(coluna): coluna for coluna in colunas}
+    mapeamento = {}
+    for campo, aliases in ALIASES_CSV.items():
+        for alias in aliases:
+            if alias in normalizadas:
+                mapeamento[campo] = normalizadas[alias]
+                break
+    if 'data' not in mapeamento or 'descricao' not in mapeamento or not (
+        'valor' in mapeamento or ('credito' in mapeamento and 'debito' in mapeamento)
+    ):
+        raise ValueError(f"CSV sem as colunas de data, histórico e valor reconhecíveis. Colunas: {list(colunas)}")
+    return mapeamento
+
+
+def linhas_de_saldo(descricoes):
+    """Máscara das linhas que são saldos informativos do extrato, e não lançamentos."""
+    compactas = normalize_descriptions(descricoes).str.replace(' ', '', regex=False)
+    return compactas.str.match(_PADRAO_LINHA_SALDO)
+
+
+def _valores_invalidos(brutos, valores):
+    """Máscara dos valores preenchidos que não puderam ser interpretados (células vazias não contam)."""
+    return valores.isna() & brutos.notna() & (brutos.astype(str).str.strip() != '')
+
+
+def iter_csv_chunks(arquivo, chunk_rows=CHUNK_ROWS, erros=None):
+    """Lê um CSV de extrato em blocos, gerando DataFrames (data, descricao, valor com sinal).
+
+    Linhas com valor inválido são descartadas e descritas em 'erros' (lista, se informada).
+    """
+    amostra = arquivo.read(64 * 1024)
+    arquivo.seek(0)
+    # Exportações de bancos brasileiros costumam vir em UTF-8 ou Windows-1252 (latin-1 nunca falha)
+    for codificacao in ('utf-8-sig', 'cp1252', 'latin-1'):
+        try:
+            # Decodificador incremental: a amostra pode terminar no meio de um caractere multibyte
+            texto_amostra = codecs.getincrementaldecoder(codificacao)().decode(amostra, final=False)
+            break
+        except UnicodeDecodeError:
+            continue
+    try:
+        separador = csv.Sniffer().sniff(texto_amostra.split('\n', 5)[0], delimiters=';,\t').delimiter
+    except csv.Error:
+        separador = ';'
+
+    leitor = pd.read_csv(
+        io.TextIOWrapper(arquivo, encoding=codificacao, newline=''),
+        sep=separador, dtype=str, chunksize=chunk_rows, skipinitialspace=True,
+    )
+    mapeamento = None
+    for chunk in leitor:
+        if mapeamento is None:
+            mapeamento = _mapear_colunas_csv(chunk.columns)
+
+        if 'valor' in mapeamento:
+            valor = parse_brl(chunk[mapeamento['valor']], errors='coerce', ponto_decimal=True)
+            invalidos = _valores_invalidos(chunk[mapeamento['valor']], valor)
+            brutos = chunk[mapeamento['valor']]
+        else:
+            credito = parse_brl(chunk[mapeamento['credito']], errors='coerce', ponto_decimal=True)
+            debito = parse_brl(chunk[mapeamento['debito']], errors='coerce', ponto_decimal=True)
+            credito_invalido = _valores_invalidos(chunk[mapeamento['credito']], credito)
+            invalidos = credito_invalido | _valores_invalidos(chunk[mapeamento['debito']], debito)
+            brutos = chunk[mapeamento['credito']].where(credito_invalido, chunk[mapeamento['debito']])
+            # Uma das colunas vem vazia em cada linha; valor inválido em qualquer uma descarta a linha
+            valor = (credito.fillna(0) - debito.fillna(0).abs()).mask(invalidos)
+        if 'tipo' in mapeamento:
+            # Coluna C/D separada: o valor vem sem sinal
+            debito = chunk[mapeamento['tipo']].astype(str).str.strip().str.upper().str[0] == 'D'
+            valor = valor.abs().where(~debito, -valor.abs())
+
+        descricao = chunk[mapeamento['descricao']].fillna('').astype(str).str.strip()
+        saldo = linhas_de_saldo(descricao)
+        invalidos &= ~saldo
+        if erros is not None and invalidos.any():
+            # Índice do bloco = posição da linha de dados; +2 pelo cabeçalho e pela numeração a partir de 1
+            exemplos = {indice + 2: bruto for indice, bruto in brutos[invalidos].head(MAX_EXEMPLOS_ERRO).items()}
+            erros.append(f"{int(invalidos.sum())} linha(s) com valor inválido descartada(s). Exemplos (linha: valor): {exemplos}")
+        yield pd.DataFrame({
+            'data': converter_datas(chunk[mapeamento['data']].str.strip()),
+            'descricao': descricao,
+            'valor': valor,
+        })[~saldo].dropna(subset=['valor'])
+
+
+def iter_statement_chunks(nome_arquivo, arquivo, chunk_rows=CHUNK_ROWS, erros=None):
+    """Importa um extrato estruturado (OFX ou CSV) pela extensão do arquivo (ver iter_csv_chunks para 'erros')."""
+    extensao = os.path.splitext(nome_arquivo)[1].lower()
+    if extensao == '.ofx':
+        return iter_ofx_chunks(arquivo, chunk_rows)
+    if extensao == '.csv':
+        return iter_csv_chunks(arquivo, chunk_rows, erros)
+    raise ValueError(f"Formato '{extensao}' não suportado para importação direta. Use um de {FORMATOS_IMPORTACAO}.")
+
+
+def to_transacao_columns(chunk, store=None):
+    """Colunas no formato do schema Transacao (valor positivo + tipo_movimentacao).
+
+    'categoria_sugerida' vem das regras de classify_transactions; 'categoria_dcf' e 'entidade'
+    ficam vazias para a etapa de classificações aprendidas / classificação em lote.
+    """
+    credito = chunk['valor'] > 0
+    return {
+        'data': chunk['data'],
+        'descricao': chunk['descricao'],
+        'valor': chunk['valor'].abs(),
+        'tipo_movimentacao': pd.Series(np.where(credito, 'CREDITO', 'DEBITO'), index=chunk.index),
+        'categoria_sugerida': classify_descriptions(chunk['descricao'], chunk['valor'], store),
+        'categoria_dcf': pd.Series(None, index=chunk.index, dtype=object),
+        'entidade': pd.Series(None, index=chunk.index, dtype=object),
+    }
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Colunas de cada transação extraída (campos do schema Transacao)
+COLUNAS_TRANSACAO = [
+    'data', 'descricao', 'valor', 'tipo_movimentacao',
+    'categoria_sugerida', 'categoria_dcf', 'entidade',
+]
+
+# Formatos de data aceitos pelo schema, tentados em ordem antes da conversão genérica
+FORMATOS_DATA = ('%d/%m/%Y', '%Y-%m-%d')
+
+
+def converter_datas(serie: pd.Series) -> pd.Series:
+    """Converte datas 'DD/MM/AAAA' e 'AAAA-MM-DD' misturadas (arquivos diferentes podem usar formatos diferentes)."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    serie = serie.astype(object).where(serie.notna(), None)
+    datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    for formato in FORMATOS_DATA:
+        faltantes = datas.isna()
+        if not faltantes.any():
+            break
+        datas[faltantes] = pd.to_datetime(serie[faltantes], format=formato, errors='coerce')
+    faltantes = datas.isna() & serie.notna()
+    if faltantes.any():
+        datas[faltantes] = pd.to_datetime(serie[faltantes], errors='coerce', dayfirst=True, format='mixed')
+    return datas
+
+
+def processar_df_transacoes(df: pd.DataFrame) -> pd.DataFrame:
+    """Processa o DataFrame para garantir tipos corretos e adicionar colunas calculadas."""
+    df['data'] = converter_datas(df['data'])
+    df['valor'] = pd.to_numeric(df['valor'], errors='coerce')
+
+    # Calcula o fluxo de caixa (valor positivo para crédito, negativo para débito)
+    df['fluxo_caixa'] = np.where(df['tipo_movimentacao'] == 'CREDITO', df['valor'], -df['valor'])
+    return df
+
+
+def _como_serie(lote):
+    if isinstance(lote, pd.Series):
+        return lote.reset_index(drop=True)
+    if isinstance(lote, (pa.Array, pa.ChunkedArray)):
+        return lote.to_pandas()
+    return pd.Series(lote)
+
+
+def _cauda(lote, quantidade):
+    """Últimos 'quantidade' itens do lote, sem converter o lote inteiro."""
+    if isinstance(lote, pd.Series):
+        return lote.iloc[len(lote) - quantidade:]
+    if isinstance(lote, (pa.Array, pa.ChunkedArray)):
+        return lote.slice(len(lote) - quantidade)
+    return lote[len(lote) - quantidade:]
+
+
+def totais_por_tipo(valores, tipos) -> dict:
+    """Soma dos valores de crédito e de débito (valores inválidos são ignorados)."""
+    valores = pd.to_numeric(_como_serie(valores), errors='coerce')
+    tipos = _como_serie(tipos)
+    return {tipo: float(valores[(tipos == tipo).to_numpy(dtype=bool)].sum()) for tipo in ('CREDITO', 'DEBITO')}
+
+
+class TransactionAccumulator:
+    """Acumula as transações de vários arquivos em lotes por coluna.
+
+    Cada lote é guardado como chegou (listas, arrays Arrow ou Series), sem recopiar o que já
+    foi acumulado; as colunas são concatenadas uma única vez ao montar o DataFrame, e a
+    normalização de tipos roda uma única vez em to_frame(). Para prévias durante a ingestão,
+    totals() e tail() custam o tamanho do lote novo e da cauda, não o do que já foi acumulado.
+    """
+
+    def __init__(self, colunas=COLUNAS_TRANSACAO):
+        self._lotes = {coluna: [] for coluna in colunas}
+        self._total = 0
+        self._tamanhos = []
+        self._totais = {'CREDITO': 0.0, 'DEBITO': 0.0}
+
+    def __len__(self):
+        return self._total
+
+    def add_records(self, transacoes):
+        """Anexa uma lista de dicts (formato de ExtratoBancarioCompleto.transacoes)."""
+        if not transacoes:
+            return
+        for coluna, lotes in self._lotes.items():
+            lotes.append([transacao.get(coluna) for transacao in transacoes])
+        self._registrar_lote(len(transacoes))
+
+    def add_columns(self, colunas):
+        """Anexa um lote já em formato colunar: {coluna: sequência} ou pyarrow.Table (todas do mesmo tamanho)."""
+        if isinstance(colunas, pa.Table):
+            colunas = dict(zip(colunas.column_names, colunas.columns))
+        tamanhos = {len(valores) for valores in colunas.values()}
+        if len(tamanhos) > 1:
+            raise ValueError(f"Colunas com tamanhos diferentes no lote: {sorted(tamanhos)}")
+        tamanho = tamanhos.pop() if tamanhos else 0
+        if not tamanho:
+            return
+        for coluna, lotes in self._lotes.items():
+            valores = colunas.get(coluna)
+            lotes.append([None] * tamanho if valores is None else valores)
+        self._registrar_lote(tamanho)
+
+    def _registrar_lote(self, tamanho):
+        self._total += tamanho
+        self._tamanhos.append(tamanho)
+        if 'valor' in self._lotes and 'tipo_movimentacao' in self._lotes:
+            for tipo, soma in totais_por_tipo(self._lotes['valor'][-1], self._lotes['tipo_movimentacao'][-1]).items():
+                self._totais[tipo] += soma
+
+    def _montar(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            coluna: pd.concat([_como_serie(lote) for lote in lotes], ignore_index=True)
+            for coluna, lotes in self._lotes.items()
+        })
+
+    def totals(self) -> dict:
+        """Somas acumuladas de crédito e débito ({'CREDITO': ..., 'DEBITO': ...}), mantidas a cada lote."""
+        return dict(self._totais)
+
+    def tail(self, quantidade) -> pd.DataFrame:
+        """Últimas transações acumuladas (visão bruta, sem normalização), para prévias na UI."""
+        if not self._total or quantidade <= 0:
+            return pd.DataFrame(columns=list(self._lotes))
+        partes = {coluna: [] for coluna in self._lotes}
+        restantes = quantidade
+        # Percorre os lotes do fim para o começo até juntar a quantidade pedida
+        for i in range(len(self._tamanhos) - 1, -1, -1):
+            tamanho = min(restantes, self._tamanhos[i])
+            for coluna, lotes in self._lotes.items():
+                partes[coluna].append(_como_serie(_cauda(lotes[i], tamanho)))
+            restantes -= tamanho
+            if not restantes:
+                break
+        return pd.DataFrame({coluna: pd.concat(series[::-1], ignore_index=True) for coluna, series in partes.items()})
+
+    def to_frame(self) -> pd.DataFrame:
+        """Monta o DataFrame final e aplica processar_df_transacoes uma única vez."""
+        if not self._total:
+            return pd.DataFrame()
+        return processar_df_transacoes(self._montar())
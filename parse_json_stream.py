@@ -0,0 +1,82 @@
+import json
+import re
+
+
+class JsonArrayStreamParser:
+    """Extrai, de um JSON recebido em pedaços, os objetos completos de um campo do tipo lista.
+
+    Cada chamada a feed() processa apenas os caracteres novos e retorna os objetos
+    que ficaram completos desde a chamada anterior. O texto acumulado continua
+    disponível em 'texto' para a validação final do documento inteiro.
+    """
+
+    def __init__(self, campo):
+        self._inicio_lista = re.compile(r'"' + re.escape(campo) + r'"\s*:\s*\[')
+        self._partes = []
+        self._buffer = ""
+        self._pos = None          # posição de leitura dentro da lista (None = lista ainda não encontrada)
+        self._profundidade = 0
+        self._inicio_objeto = None
+        self._em_string = False
+        self._escape = False
+        self.concluido = False
+
+    @property
+    def texto(self):
+        return "".join(self._partes)
+
+    def feed(self, pedaco):
+        """Acrescenta um pedaço de texto e retorna a lista de objetos completados por ele."""
+        if not pedaco:
+            return []
+        self._partes.append(pedaco)
+        if self.concluido:
+            return []
+        self._buffer += pedaco
+
+        if self._pos is None:
+            encontrado = self._inicio_lista.search(self._buffer)
+            if not encontrado:
+                return []
+            self._buffer = self._buffer[encontrado.end():]
+            self._pos = 0
+
+        objetos = []
+        buffer = self._buffer
+        for i in range(self._pos, len(buffer)):
+            c = buffer[i]
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._em_string = False
+            elif c == '"':
+                self._em_string = True
+            elif c in "{[":
+                if self._profundidade == 0:
+                    self._inicio_objeto = i
+                self._profundidade += 1
+            elif c in "}]":
+                if self._profundidade == 0:
+                    # Fechamento da própria lista: nada mais a extrair
+                    self.concluido = True
+                    break
+                self._profundidade -= 1
+                if self._profundidade == 0:
+                    objetos.append(json.loads(buffer[self._inicio_objeto:i + 1]))
+                    self._inicio_objeto = None
+
+        # Descarta o que já foi consumido, preservando um objeto ainda incompleto
+        if self.concluido:
+            self._buffer = ""
+            self._pos = 0
+        elif self._inicio_objeto is not None:
+            self._buffer = buffer[self._inicio_objeto:]
+            self._pos = len(self._buffer)
+            self._inicio_objeto = 0
+        else:
+            self._buffer = ""
+            self._pos = 0
+        return objetos
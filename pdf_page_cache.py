@@ -0,0 +1,228 @@
+import hashlib
+import io
+import os
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pdfplumber
+import pyarrow as pa
+from pypdf import PdfReader
+
+from extract_with_gemini import (
+    MODELO_EXTRACAO, SCHEMA_TRANSACAO, extrair_extrato, extrair_extrato_stream, texto_pagina,
+)
+
+# Versão do prompt/schema de extração: mudar invalida os resultados de LLM já guardados por página
+VERSAO_EXTRACAO = 2
+
+# Escopos no store (mesmo SQLite chave -> JSON das classificações aprendidas)
+ESCOPO_TEXTO_PAGINA = "pagina_texto"
+ESCOPO_EXTRACAO_PAGINA = f"pagina_extracao|{MODELO_EXTRACAO}|v{VERSAO_EXTRACAO}"
+
+MAX_PAGINAS_SIMULTANEAS = 4
+
+# Texto e transações das páginas ficam no store (em claro) por no máximo este tempo
+TTL_PAGINAS = int(os.environ.get("HEDGEWISE_TTL_PAGINAS_DIAS", "7")) * 24 * 3600
+
+# Cabeçalho do extrato repassado às demais páginas: linhas da primeira página até a primeira transação
+MAX_LINHAS_CABECALHO = 15
+MAX_CARACTERES_CABECALHO = 1500
+_LINHA_COM_DATA = re.compile(r'^\s*\d{1,2}[/.-]\d{1,2}')
+
+# Prefixo de subconjunto de fonte ('ABCDEF+Arial'): muda a cada geração do PDF sem mudar o texto
+_PREFIXO_SUBCONJUNTO = re.compile(r'^/?[A-Z]{6}\+')
+
+
+def _digerir_recursos(recursos, digest, vistos):
+    """Acrescenta ao hash o que, além do content stream, define o texto da página:
+    mapeamento das fontes (ToUnicode/Encoding) e o conteúdo de Form XObjects (recursivo)."""
+    if recursos is None:
+        return
+    recursos = recursos.get_object()
+
+    fontes = recursos.get('/Font')
+    for nome, fonte in sorted((fontes.get_object() if fontes is not None else {}).items()):
+        fonte = fonte.get_object()
+        digest.update(nome.encode())
+        digest.update(_PREFIXO_SUBCONJUNTO.sub('', str(fonte.get('/BaseFont', ''))).encode())
+        digest.update(str(fonte.get('/Encoding', '')).encode())
+        to_unicode = fonte.get('/ToUnicode')
+        if to_unicode is not None:
+            digest.update(to_unicode.get_object().get_data())
+
+    xobjects = recursos.get('/XObject')
+    for nome, referencia in sorted((xobjects.get_object() if xobjects is not None else {}).items()):
+        xobject = referencia.get_object()
+        # Imagens não alteram o texto extraído; formulários podem conter a página inteira
+        if xobject.get('/Subtype') != '/Form' or id(xobject) in vistos:
+            continue
+        vistos.add(id(xobject))
+        digest.update(nome.encode())
+        digest.update(xobject.get_data())
+        _digerir_recursos(xobject.get('/Resources'), digest, vistos)
+
+
+def fingerprint_page(pagina):
+    """Hash do conteúdo de uma página do pypdf (independente do restante do arquivo)."""
+    digest = hashlib.sha256()
+    conteudo = pagina.get_contents()
+    digest.update(conteudo.get_data() if conteudo is not None else b'')
+    _digerir_recursos(pagina.get('/Resources'), digest, set())
+    return digest.hexdigest()
+
+
+def fingerprint_pages(pdf_bytes):
+    """Fingerprint de cada página, na ordem do documento."""
+    return [fingerprint_page(pagina) for pagina in PdfReader(io.BytesIO(pdf_bytes)).pages]
+
+
+def fingerprint_text(texto):
+    """Fingerprint de uma página já convertida em texto (páginas que não vêm de um PDF)."""
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def page_texts(pdf_bytes, fingerprints, store=None):
+    """Texto + tabelas de cada página; só as páginas ainda não vistas (ou expiradas) passam pelo pdfplumber."""
+    textos = store.get_many(ESCOPO_TEXTO_PAGINA, fingerprints, TTL_PAGINAS) if store is not None else {}
+    novas = {}
+    pendentes = [i for i, fingerprint in enumerate(fingerprints) if fingerprint not in textos]
+    if pendentes:
+        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+            for i in pendentes:
+                novas.setdefault(fingerprints[i], texto_pagina(pdf.pages[i]))
+        if store is not None:
+            store.purge(ESCOPO_TEXTO_PAGINA, TTL_PAGINAS)
+            store.put_many(ESCOPO_TEXTO_PAGINA, novas)
+    textos.update(novas)
+    return [textos[fingerprint] for fingerprint in fingerprints]
+
+
+def statement_header(textos):
+    """Cabeçalho do extrato (banco, conta, período): início da primeira página com texto, até a
+    primeira linha que começa com data. Retorna (índice da página, cabeçalho) ou (None, '')."""
+    for indice, texto in enumerate(textos):
+        if not texto.strip():
+            continue
+        linhas = []
+        for linha in texto.splitlines():
+            if _LINHA_COM_DATA.match(linha) or len(linhas) == MAX_LINHAS_CABECALHO:
+                break
+            if linha.strip():
+                linhas.append(linha.strip())
+        return indice, "\n".join(linhas)[:MAX_CARACTERES_CABECALHO]
+    return None, ''
+
+
+def _pagina_do_store(registro):
+    return {
+        'transacoes': pa.Table.from_pylist(registro['transacoes'], schema=SCHEMA_TRANSACAO),
+        'saldo_final': registro['saldo_final'],
+        'erros_validacao': registro['erros_validacao'],
+    }
+
+
+def _pagina_para_store(resultado):
+    # Só o store (JSON) precisa das transações como objetos Python
+    return {
+        'transacoes': resultado['transacoes'].to_pylist(),
+        'saldo_final': resultado['saldo_final'],
+        'erros_validacao': resultado['erros_validacao'],
+    }
+
+
+def extract_statement_pages(pdf_bytes, filename, client, store=None, ao_receber_transacoes=None,
+                            max_workers=MAX_PAGINAS_SIMULTANEAS):
+    """Extrai o extrato página a página, reaproveitando texto e resultado da LLM de páginas já vistas.
+
+    Retorna o mesmo formato de decodificar_extrato (ver extract_pages).
+    """
+    fingerprints = fingerprint_pages(pdf_bytes)
+    textos = page_texts(pdf_bytes, fingerprints, store)
+    return extract_pages(textos, filename, client, store, ao_receber_transacoes, max_workers, fingerprints)
+
+
+def extract_pages(textos, filename, client, store=None, ao_receber_transacoes=None,
+                  max_workers=MAX_PAGINAS_SIMULTANEAS, fingerprints=None):
+    """Extrai um extrato já dividido em páginas de texto, reaproveitando o resultado da LLM de páginas já vistas.
+
+    Cada página nova vira uma requisição de extração, em paralelo (também em streaming, quando
+    'ao_receber_transacoes' é informado), com o cabeçalho da primeira página como contexto. Se a
+    extração de alguma página falhar, as páginas concluídas ficam no cache e o erro é propagado.
+    """
+    if fingerprints is None:
+        fingerprints = [fingerprint_text(texto) for texto in textos]
+    if not any(texto.strip() for texto in textos):
+        raise ValueError(f"Não foi possível extrair texto do arquivo {filename}.")
+    texto_por_fingerprint = dict(zip(fingerprints, textos))
+
+    # A página do cabeçalho já o contém; as demais recebem o cabeçalho como contexto do prompt. O
+    # resultado é guardado só pelo fingerprint da página: o cabeçalho muda a cada reimpressão ou
+    # extensão do período, e as páginas antigas não precisam ser extraídas de novo
+    pagina_cabecalho, cabecalho = statement_header(textos)
+    contexto_por_fingerprint = {}
+    for i, fingerprint in enumerate(fingerprints):
+        contexto_por_fingerprint.setdefault(fingerprint, '' if i == pagina_cabecalho else cabecalho)
+
+    guardados = store.get_many(ESCOPO_EXTRACAO_PAGINA, fingerprints, TTL_PAGINAS) if store is not None else {}
+    resultados = {fingerprint: _pagina_do_store(registro) for fingerprint, registro in guardados.items()}
+    # Páginas sem texto (capa, verso em branco) não vão para a LLM
+    resultados.update({
+        fingerprint: {'transacoes': SCHEMA_TRANSACAO.empty_table(), 'saldo_final': 0.0, 'erros_validacao': []}
+        for fingerprint, texto in texto_por_fingerprint.items() if not texto.strip()
+    })
+    pendentes = [fingerprint for fingerprint in dict.fromkeys(fingerprints) if fingerprint not in resultados]
+
+    if ao_receber_transacoes is not None:
+        # Páginas do cache aparecem na prévia imediatamente
+        reaproveitadas = [t for fingerprint in fingerprints if fingerprint in guardados for t in guardados[fingerprint]['transacoes']]
+        if reaproveitadas:
+            ao_receber_transacoes(reaproveitadas)
+
+    # Em streaming as páginas também rodam em paralelo: as parciais passam por uma fila e o callback
+    # é chamado na thread de quem chamou (o Streamlit só aceita atualizações da thread do script)
+    parciais = queue.SimpleQueue() if ao_receber_transacoes is not None else None
+
+    def extrair(fingerprint):
+        texto, contexto = texto_por_fingerprint[fingerprint], contexto_por_fingerprint[fingerprint]
+        if parciais is not None:
+            return extrair_extrato_stream(texto, filename, client, parciais.put, contexto)
+        return extrair_extrato(texto, filename, client, contexto)
+
+    novos, erro = {}, None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {fingerprint: executor.submit(extrair, fingerprint) for fingerprint in pendentes}
+        if parciais is not None:
+            while not (all(futuro.done() for futuro in futuros.values()) and parciais.empty()):
+                try:
+                    ao_receber_transacoes(parciais.get(timeout=0.1))
+                except queue.Empty:
+                    pass
+    for fingerprint, futuro in futuros.items():
+        try:
+            novos[fingerprint] = futuro.result()
+        except Exception as e:
+            erro = erro or e
+    if store is not None:
+        if novos:
+            store.purge(ESCOPO_EXTRACAO_PAGINA, TTL_PAGINAS)
+        store.put_many(ESCOPO_EXTRACAO_PAGINA, {fingerprint: _pagina_para_store(resultado) for fingerprint, resultado in novos.items()})
+    if erro is not None:
+        raise erro
+    resultados.update(novos)
+
+    por_pagina = [resultados[fingerprint] for fingerprint in fingerprints]
+    saldos = [resultado['saldo_final'] for resultado in por_pagina if resultado['saldo_final']]
+    erros = [
+        f"Página {numero}: {mensagem}"
+        for numero, resultado in enumerate(por_pagina, start=1) for mensagem in resultado['erros_validacao']
+    ]
+    return {
+        'transacoes': pa.concat_tables([resultado['transacoes'].cast(SCHEMA_TRANSACAO) for resultado in por_pagina]),
+        'saldo_final': saldos[-1] if saldos else 0.0,
+        'relatorio_analise': (
+            f"Extração de dados concluída com sucesso: {len(fingerprints)} página(s), "
+            f"{len(fingerprints) - sum(f in novos for f in fingerprints)} reaproveitada(s) do cache de páginas."
+        ),
+        'erros_validacao': erros,
+    }
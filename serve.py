@@ -0,0 +1,29 @@
+"""Entrada ASGI do app: o mesmo app.py, mais a rota de download das exportações em streaming.
+
+Com 'streamlit run app.py' as exportações passam pelo st.download_button, que mantém o arquivo
+inteiro em memória; servindo por aqui, o arquivo gerado em disco é enviado em blocos.
+
+    streamlit run serve.py
+"""
+import os
+
+import streamlit as st
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from export_reports import ROTA_EXPORTACAO, enable_streaming_route, iter_file, take_export
+
+
+async def baixar_exportacao(request):
+    exportacao = take_export(request.path_params['token'])
+    if exportacao is None:
+        return PlainTextResponse("Exportação expirada ou já baixada. Gere o arquivo novamente.", status_code=404)
+    caminho, nome_arquivo, mime = exportacao
+    return StreamingResponse(iter_file(caminho), media_type=mime, headers={
+        'Content-Disposition': f'attachment; filename="{nome_arquivo}"',
+        'Content-Length': str(os.path.getsize(caminho)),
+    })
+
+
+enable_streaming_route()
+app = st.App("app.py", routes=[Route(ROTA_EXPORTACAO + "/{token}", baixar_exportacao)])
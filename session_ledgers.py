@@ -0,0 +1,214 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Diretório dos razões despejados em disco (Feather/Arrow IPC sem compressão, lidos via mmap)
+DEFAULT_SPILL_DIR = os.environ.get("HEDGEWISE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "hedgewise_razoes"))
+
+# Orçamento do processo inteiro para razões residentes em heap (todas as sessões somadas)
+ORCAMENTO_MEMORIA_PADRAO = int(os.environ.get("HEDGEWISE_ORCAMENTO_MEMORIA_MB", "512")) * 1024 * 1024
+
+# Sessão sem interação há mais que isso é ociosa: seu razão sai do heap e fica só em disco
+SEGUNDOS_OCIOSIDADE = 300
+# O Streamlit não avisa quando a aba é fechada: depois disso a sessão é esquecida e o arquivo removido
+SEGUNDOS_EXPIRACAO = 6 * 3600
+# get() roda a cada rerun do Streamlit: ociosidade e expiração são verificadas no máximo com esta frequência
+SEGUNDOS_ENTRE_VERIFICACOES = 5.0
+
+
+def fingerprint_ledger(df: pd.DataFrame) -> str:
+    """Hash do conteúdo do razão (colunas, tipos, índice e valores)."""
+    digest = hashlib.sha256()
+    digest.update(repr([(str(coluna), str(tipo)) for coluna, tipo in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _tamanho(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+class _Razao:
+    __slots__ = ('fingerprint', 'df', 'dtypes', 'mapeado', 'bytes', 'caminho', 'ultimo_acesso')
+
+    def __init__(self, fingerprint, df, caminho):
+        self.fingerprint = fingerprint
+        self.df = df
+        self.dtypes = df.dtypes
+        self.mapeado = False
+        self.bytes = _tamanho(df)
+        self.caminho = caminho
+        self.ultimo_acesso = time.monotonic()
+
+
+class LedgerGovernor:
+    """Razões (DataFrames de transações) das sessões do processo, com orçamento de memória.
+
+    - cada sessão aponta para um razão imutável identificado pelo hash do conteúdo: sessões que
+      analisam o mesmo cliente compartilham o mesmo DataFrame;
+    - razões de sessões ociosas, ou os menos usados quando o orçamento estoura, são gravados uma
+      vez em Feather e saem da memória; a gravação e a leitura do arquivo são feitas fora do lock;
+    - ao voltar, o razão é lido por memory map com os mesmos dtypes de quando foi publicado. Colunas
+      numéricas, datas e texto 'str' com pyarrow (padrão do pandas 3) apontam para o arquivo, sem
+      cópia; colunas object (e todo texto no pandas 2) viram objetos Python de novo, o que é cópia;
+    - razões recarregados contam no orçamento como os demais (o tamanho é medido de novo na
+      leitura) e também saem quando ele estoura;
+    - o consumo passa a depender das sessões ativas, não de quantas abas já foram abertas.
+
+    Os DataFrames retornados são compartilhados: trate-os como somente leitura.
+    """
+
+    def __init__(self, diretorio=DEFAULT_SPILL_DIR, orcamento=ORCAMENTO_MEMORIA_PADRAO,
+                 ociosidade=SEGUNDOS_OCIOSIDADE, expiracao=SEGUNDOS_EXPIRACAO,
+                 intervalo_verificacao=SEGUNDOS_ENTRE_VERIFICACOES):
+        self.diretorio = diretorio
+        self.orcamento = orcamento
+        self.ociosidade = ociosidade
+        self.expiracao = expiracao
+        self.intervalo_verificacao = intervalo_verificacao
+        os.makedirs(diretorio, exist_ok=True)
+        self._razoes = {}
+        self._sessoes = {}
+        self._proxima_verificacao = 0.0
+        self._lock = threading.Lock()
+        self.estatisticas = {'publicados': 0, 'compartilhados': 0, 'despejados': 0, 'recarregados': 0}
+
+    def publish(self, sessao, df: pd.DataFrame) -> str:
+        """Associa o razão à sessão (substituindo o anterior) e retorna o fingerprint dele."""
+        fingerprint = fingerprint_ledger(df)
+        with self._lock:
+            razao = self._razoes.get(fingerprint)
+            if razao is None:
+                caminho = os.path.join(self.diretorio, f"{fingerprint}.feather")
+                self._razoes[fingerprint] = razao = _Razao(fingerprint, df, caminho)
+                self.estatisticas['publicados'] += 1
+            else:
+                self.estatisticas['compartilhados'] += 1
+            razao.ultimo_acesso = time.monotonic()
+            self._sessoes[sessao] = [fingerprint, razao.ultimo_acesso]
+            despejos = self._governar()
+        self._despejar(despejos)
+        return fingerprint
+
+    def get(self, sessao):
+        """Razão da sessão (recarregado do disco se tiver sido despejado), ou None."""
+        with self._lock:
+            registro = self._sessoes.get(sessao)
+            razao = self._razoes[registro[0]] if registro is not None else None
+            if razao is not None:
+                razao.ultimo_acesso = registro[1] = time.monotonic()
+            df = razao.df if razao is not None else None
+            despejos = self._governar() if time.monotonic() >= self._proxima_verificacao else []
+        self._despejar(despejos)
+        if razao is None or df is not None:
+            return df
+
+        df = self._carregar(razao)
+        with self._lock:
+            if razao.df is None:
+                razao.df, razao.mapeado, razao.bytes = df, True, _tamanho(df)
+                self.estatisticas['recarregados'] += 1
+            else:
+                df = razao.df  # Outra sessão recarregou o mesmo razão enquanto este era lido
+            # O razão recarregado volta a ocupar memória: o orçamento é verificado na hora
+            despejos = self._governar()
+        self._despejar(despejos)
+        return df
+
+    def release(self, sessao):
+        """Desassocia a sessão do seu razão (o arquivo some quando nenhuma outra sessão o usa)."""
+        with self._lock:
+            self._sessoes.pop(sessao, None)
+            despejos = self._governar()
+        self._despejar(despejos)
+
+    def uso_memoria(self) -> dict:
+        """Bytes dos razões publicados e dos recarregados do disco (ambos contam no orçamento), e
+        sessões ativas/total."""
+        with self._lock:
+            agora = time.monotonic()
+            return {
+                'residente': sum(r.bytes for r in self._razoes.values() if r.df is not None and not r.mapeado),
+                'mapeado': sum(r.bytes for r in self._razoes.values() if r.df is not None and r.mapeado),
+                'razoes': len(self._razoes),
+                'sessoes_ativas': sum(agora - acesso < self.ociosidade for _, acesso in self._sessoes.values()),
+                'sessoes': len(self._sessoes),
+            }
+
+    def _carregar(self, razao):
+        # Sem compressão, read_table com memory_map não copia os buffers. O to_pandas escolhe os tipos
+        # pela versão do pandas (ex: object vira 'str' no pandas 3): só as colunas que mudaram são convertidas
+        tabela = feather.read_table(pa.memory_map(razao.caminho), memory_map=True)
+        df = tabela.to_pandas(split_blocks=True)
+        diferentes = {coluna: tipo for coluna, tipo in razao.dtypes.items() if df[coluna].dtype != tipo}
+        return df.astype(diferentes) if diferentes else df
+
+    def _gravar(self, df, caminho):
+        tabela = pa.Table.from_pandas(df)
+        # Texto como large_string (o tipo do 'str' do pandas): a leitura não precisa alargar os offsets
+        tabela = tabela.cast(pa.schema(
+            [campo.with_type(pa.large_string()) if pa.types.is_string(campo.type) else campo for campo in tabela.schema],
+            metadata=tabela.schema.metadata,
+        ))
+        # Um único record batch: colunas numéricas em vários pedaços seriam concatenadas (copiadas) na leitura
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        feather.write_feather(tabela, temporario, compression='uncompressed', chunksize=max(1, tabela.num_rows))
+        # O conteúdo é imutável: cada fingerprint é gravado uma única vez (gravação atômica)
+        os.replace(temporario, caminho)
+
+    def _despejar(self, despejos):
+        """Grava (fora do lock) os razões escolhidos por _governar e os tira da memória."""
+        for razao, df, _ in despejos:
+            if not os.path.exists(razao.caminho):
+                self._gravar(df, razao.caminho)
+        if not despejos:
+            return
+        with self._lock:
+            for razao, df, acesso in despejos:
+                if self._razoes.get(razao.fingerprint) is not razao:
+                    # Descartado durante a gravação: o arquivo só fica se o mesmo conteúdo foi publicado de novo
+                    if razao.fingerprint not in self._razoes:
+                        self._remover_arquivo(razao.caminho)
+                    continue
+                if razao.df is not df or razao.ultimo_acesso != acesso:
+                    continue  # Usado (ou recarregado) enquanto era gravado: fica na memória
+                if not razao.mapeado:
+                    self.estatisticas['despejados'] += 1
+                razao.df = None
+                razao.mapeado = False
+
+    @staticmethod
+    def _remover_arquivo(caminho):
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass  # Nunca foi despejado (ou já foi removido)
+
+    def _governar(self):
+        """Expira sessões, descarta razões sem sessão e escolhe os que saem da memória (chamado com o
+        lock; a gravação é feita depois, por _despejar)."""
+        agora = time.monotonic()
+        self._proxima_verificacao = agora + self.intervalo_verificacao
+        for sessao, (_, acesso) in list(self._sessoes.items()):
+            if agora - acesso > self.expiracao:
+                del self._sessoes[sessao]
+
+        em_uso = {fingerprint for fingerprint, _ in self._sessoes.values()}
+        for fingerprint in [f for f in self._razoes if f not in em_uso]:
+            self._remover_arquivo(self._razoes.pop(fingerprint).caminho)
+
+        # Ociosos saem sempre; acima do orçamento, até razões de sessões ativas (os menos usados primeiro)
+        carregados = sorted((r for r in self._razoes.values() if r.df is not None), key=lambda r: r.ultimo_acesso)
+        excedente = sum(r.bytes for r in carregados) - self.orcamento
+        despejos = []
+        for razao in carregados:
+            if agora - razao.ultimo_acesso > self.ociosidade or excedente > 0:
+                despejos.append((razao, razao.df, razao.ultimo_acesso))
+                excedente -= razao.bytes
+        return despejos
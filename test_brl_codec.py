@@ -0,0 +1,34 @@
+import numpy as np
+
+from brl_codec import format_brl, parse_brl
+
+
+def formatar_brl_antigo(valor):
+    """formatar_brl original do app (um valor por vez), referência para format_brl."""
+    valor_us = f"{valor:,.2f}"
+    return "R$ " + valor_us.replace(",", "TEMP_SEP").replace(".", ",").replace("TEMP_SEP", ".")
+
+
+def test_format_brl_arredonda_como_formatar_brl():
+    casos = [2.675, 0.005, 0.015, 0.125, -0.125, 1.005, -2.675, 1234567.895, 1e15 + 0.125]
+    aleatorio = np.random.default_rng(0)
+    casos += list(aleatorio.integers(-10**8, 10**8, 20_000) / 1000) + list(aleatorio.uniform(-1e7, 1e7, 20_000))
+    # Valores que arredondam para zero saem sem o '-0,00' do formatador antigo
+    casos = [valor for valor in casos if round(valor, 2) != 0]
+
+    divergentes = [
+        (valor, novo, formatar_brl_antigo(valor))
+        for valor, novo in zip(casos, format_brl(casos)) if novo != formatar_brl_antigo(valor)
+    ]
+    assert not divergentes, divergentes[:5]
+
+
+def test_parse_brl_aceita_numeros():
+    assert parse_brl([1.5, 2]).tolist() == [1.5, 2.0]
+    assert parse_brl([1.5, '1.234,50', '123,45 D']).tolist() == [1.5, 1234.5, -123.45]
+
+
+if __name__ == "__main__":
+    test_format_brl_arredonda_como_formatar_brl()
+    test_parse_brl_aceita_numeros()
+    print("format_brl/parse_brl: OK")